@@ -1,19 +1,44 @@
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
+
 from django.contrib import admin, messages
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import TruncDate
+from django.http import HttpResponseRedirect
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 
+from .aggregates import months_changed, transaction_count, transactions_removed
 from .api import get_api
+from .jobs import start_job
 from .models import (
     Account,
+    AccountSyncResult,
+    ArchivedTransaction,
+    BackfillProgress,
     Balance,
     Institution,
+    InstitutionCatalog,
     Integration,
+    Job,
+    MonthlyRollup,
+    PayloadDictionary,
     Requisition,
+    SyncPriority,
+    SyncRequest,
+    SyncRun,
     Token,
     Transaction,
+    TransactionResponse,
 )
 
+SYNC_CHART_DAYS = 30
+SYNC_BATCH_SIZE = 10
+
 
 class NoAdd:
     def has_add_permission(self, request, obj=None):
@@ -58,19 +83,41 @@ class TokenAdmin(NoAddChange, BaseAdmin):
     ]
 
 
+def job_started(modeladmin, request, job):
+    modeladmin.message_user(request, f"Started: {job}", messages.INFO)
+    return HttpResponseRedirect(
+        reverse("admin:django_nordigen_job_change", args=[job.pk])
+    )
+
+
+def refresh_institution(started, item):
+    kind, value = item
+    if kind == "country":
+        get_api().sync_institutions(value)
+        return
+
+    # Institutions missing from their country catalogs are fetched one by one
+    institution = Institution.objects.get(nordigen_id=value)
+    if institution.updated_at < started:
+        institution.api_data = get_api().get_institution_data(value)
+        institution.save(update_fields=["api_data", "updated_at"])
+
+
 def refresh_institutions(
     modeladmin: "InstitutionAdmin", request, queryset: models.QuerySet[Institution]
 ):
-    api = get_api()
-    count = 0
-    for institution in queryset:
-        institution.api_data = api.get_institution_data(institution.nordigen_id)
-        institution.save()
-        count += 1
-
-    modeladmin.message_user(
-        request, f"Refreshed {count} institutions", messages.SUCCESS
+    countries = {
+        country for institution in queryset for country in institution.countries
+    }
+    items = [("country", country) for country in sorted(countries)] + [
+        ("institution", institution.nordigen_id) for institution in queryset
+    ]
+    job = start_job(
+        f"Refresh {queryset.count()} institutions",
+        partial(refresh_institution, timezone.now()),
+        items,
     )
+    return job_started(modeladmin, request, job)
 
 
 @admin.register(Institution)
@@ -83,6 +130,7 @@ class InstitutionAdmin(NoAddChange, BaseAdmin):
         "nordigen_id",
         "name",
         "logo_image",
+        "updated_at",
     ]
 
     actions = [
@@ -93,6 +141,24 @@ class InstitutionAdmin(NoAddChange, BaseAdmin):
         return format_html('<img width=30 src="{}">', obj.logo)
 
 
+@admin.register(InstitutionCatalog)
+class InstitutionCatalogAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "country",
+        "synced_at",
+    ]
+
+
+def sync_requisition_now(requisition_id):
+    requisition = Requisition.objects.get(pk=requisition_id)
+    get_api(requisition.integration).sync(
+        [requisition.nordigen_id],
+        timedelta(0),
+        history=False,
+        priority=SyncPriority.INTERACTIVE,
+    )
+
+
 class AccountInline(NoAddChangeDelete, admin.TabularInline):
     model = Requisition.account_set.through
 
@@ -107,11 +173,14 @@ class RequisitionAdmin(NoAdd, BaseAdmin):
         "nordigen_id",
         "institution",
         "created_at",
+        "status",
+        "expires_at",
         "active",
     ]
 
     list_filter = [
         "institution",
+        "status",
         "active",
     ]
 
@@ -123,6 +192,38 @@ class RequisitionAdmin(NoAdd, BaseAdmin):
         AccountInline,
     ]
 
+    actions = [
+        "sync_now",
+    ]
+
+    @admin.action(description="Sync selected requisitions now")
+    def sync_now(self, request, queryset):
+        job = start_job(
+            f"Sync {queryset.count()} requisitions",
+            sync_requisition_now,
+            queryset.values_list("pk", flat=True),
+        )
+        return job_started(self, request, job)
+
+
+def sync_accounts_now(batch):
+    integration_id, account_ids = batch
+    get_api(Integration.objects.get(pk=integration_id)).sync_accounts(
+        list(Account.objects.filter(pk__in=account_ids)),
+        priority=SyncPriority.INTERACTIVE,
+    )
+
+
+def account_batches(queryset, size=SYNC_BATCH_SIZE):
+    # One sync run per integration and batch, small enough to show progress
+    rows = queryset.order_by("integration", "pk").values_list("integration", "pk")
+    batches = []
+    for integration_id, group in groupby(rows, key=itemgetter(0)):
+        account_ids = [pk for _, pk in group]
+        for start in range(0, len(account_ids), size):
+            batches.append((integration_id, account_ids[start:][:size]))
+    return batches
+
 
 class RequisitionInline(NoAddChangeDelete, admin.TabularInline):
     model = Account.requisitions.through
@@ -159,16 +260,25 @@ class AccountAdmin(NoAdd, BaseAdmin):
         RequisitionInline,
     ]
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(transaction_count=models.Count("transaction"))
+    actions = [
+        "sync_now",
+    ]
+
+    @admin.action(description="Sync selected accounts now")
+    def sync_now(self, request, queryset):
+        job = start_job(
+            f"Sync {queryset.count()} accounts",
+            sync_accounts_now,
+            account_batches(queryset),
+        )
+        return job_started(self, request, job)
 
     def transactions(self, obj):
         return format_html(
             '<a href="{}?account__id__exact={}">{}</a>',
             reverse("admin:django_nordigen_transaction_changelist"),
             obj.pk,
-            obj.transaction_count,
+            transaction_count(obj),
         )
 
 
@@ -188,6 +298,23 @@ class BalanceAdmin(NoAddChange, BaseAdmin):
         "synced_at",
     ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_payload()
+
+
+@admin.register(PayloadDictionary)
+class PayloadDictionaryAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "__str__",
+        "institution",
+        "algorithm",
+        "created_at",
+    ]
+
+    exclude = [
+        "data",
+    ]
+
 
 @admin.register(Transaction)
 class TransactionAdmin(NoAddChange, BaseAdmin):
@@ -197,6 +324,10 @@ class TransactionAdmin(NoAddChange, BaseAdmin):
 
     date_hierarchy = "booking_date"
 
+    exclude = [
+        "api_data_compressed",
+    ]
+
     list_display = [
         "__str__",
         "booking_date",
@@ -206,4 +337,219 @@ class TransactionAdmin(NoAddChange, BaseAdmin):
 
     list_filter = [
         "account",
+        "duplicate",
+    ]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_payload()
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            changed = transactions_deleted({obj.account_id: {obj.fingerprint}})
+        refresh_aggregates(changed)
+
+    def delete_queryset(self, request, queryset):
+        deleted = defaultdict(set)
+        for account_id, fingerprint in queryset.values_list(
+            "account_id", "fingerprint"
+        ):
+            deleted[account_id].add(fingerprint)
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            changed = transactions_deleted(deleted)
+        refresh_aggregates(changed)
+
+
+def transactions_deleted(deleted):
+    # Rollups and duplicate flags of the accounts, and of their later
+    # siblings, are rebuilt. Returns changed months per account.
+    changed = {}
+    for account in Account.objects.filter(pk__in=deleted).order_by("pk"):
+        Account.objects.select_for_update().filter(pk=account.pk).exists()
+        changed[account.pk] = MonthlyRollup.rebuild(account)
+        for sibling_id, months in account.unflag_duplicates(
+            deleted[account.pk]
+        ).items():
+            changed.setdefault(sibling_id, set()).update(months)
+    return changed
+
+
+def refresh_aggregates(changed):
+    transactions_removed(changed)
+    for account_id, months in changed.items():
+        months_changed(account_id, months)
+
+
+@admin.register(ArchivedTransaction)
+class ArchivedTransactionAdmin(NoAddChangeDelete, TransactionAdmin):
+    pass
+
+
+@admin.register(TransactionResponse)
+class TransactionResponseAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "__str__",
+        "account",
+        "created_at",
+    ]
+
+    list_filter = [
+        "account",
+    ]
+
+    exclude = [
+        "data",
+    ]
+
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "account",
+        "month",
+        "currency",
+        "inflow",
+        "outflow",
+        "count",
+    ]
+
+    list_filter = [
+        "account",
+        "currency",
+    ]
+
+    date_hierarchy = "month"
+
+
+@admin.register(SyncRequest)
+class SyncRequestAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "account",
+        "priority",
+        "history",
+        "attempts",
+        "created_at",
+        "updated_at",
+        "not_before",
+    ]
+
+    list_filter = [
+        "priority",
+    ]
+
+
+@admin.register(BackfillProgress)
+class BackfillProgressAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "name",
+        "last_pk",
+        "max_pk",
+        "changed",
+        "finished_at",
+    ]
+
+
+@admin.register(Job)
+class JobAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "__str__",
+        "status",
+        "progress",
+        "failed",
+        "created_at",
+        "finished_at",
+    ]
+
+    list_filter = [
+        "status",
+    ]
+
+    readonly_fields = [
+        "progress",
+    ]
+
+    def progress(self, obj):
+        return f"{obj.done}/{obj.total} ({obj.percent}%)"
+
+
+class AccountSyncResultInline(NoAddChangeDelete, admin.TabularInline):
+    model = AccountSyncResult
+    fields = readonly_fields = [
+        "account",
+        "status",
+        "started_at",
+        "duration",
+        "api_calls",
+        "transactions_created",
+        "error",
+    ]
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "__str__",
+        "integration",
+        "status",
+        "duration",
+        "api_calls",
+        "transactions_created",
+        "history",
+        "priority",
+    ]
+
+    list_filter = [
+        "status",
+        "history",
+        "priority",
+    ]
+
+    date_hierarchy = "started_at"
+
+    inlines = [
+        AccountSyncResultInline,
+    ]
+
+    def changelist_view(self, request, extra_context=None):
+        since = timezone.now() - timedelta(days=SYNC_CHART_DAYS)
+        rows = list(
+            SyncRun.objects.filter(started_at__gte=since, duration__isnull=False)
+            .annotate(day=TruncDate("started_at"))
+            .values("day")
+            .annotate(
+                runs=models.Count("pk"),
+                avg_duration=models.Avg("duration"),
+                max_duration=models.Max("duration"),
+            )
+            .order_by("day")
+        )
+        longest = max([row["max_duration"] for row in rows], default=None)
+        for row in rows:
+            row["avg_percent"] = 100 * row["avg_duration"] / longest if longest else 0
+            row["max_percent"] = 100 * row["max_duration"] / longest if longest else 0
+
+        extra_context = dict(
+            extra_context or {},
+            sync_chart_days=SYNC_CHART_DAYS,
+            sync_chart=rows,
+        )
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(AccountSyncResult)
+class AccountSyncResultAdmin(NoAddChange, BaseAdmin):
+    list_display = [
+        "__str__",
+        "status",
+        "duration",
+        "api_calls",
+        "transactions_created",
+    ]
+
+    list_filter = [
+        "status",
+        "account",
     ]
+
+    date_hierarchy = "started_at"
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+MISSING = object()
+
+DEFAULT_AGGREGATE_TTL = 300
+
+
+def get_cache():
+    return caches[getattr(settings, "NORDIGEN_CACHE", DEFAULT_CACHE_ALIAS)]
+
+
+def account_key(account_id, name, *parts):
+    return ":".join(["nordigen", "account", str(account_id), name, *map(str, parts)])
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def get_ttl(cache):
+    # Invalidation only reaches the process that syncs, so values in a
+    # per-process cache must expire for other processes to see changes
+    ttl = getattr(settings, "NORDIGEN_AGGREGATE_TTL", DEFAULT_AGGREGATE_TTL)
+    if ttl is None and isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured(
+            "NORDIGEN_AGGREGATE_TTL = None needs a cache shared between processes"
+        )
+    return ttl
+
+
+def read_through(key, compute):
+    cache = get_cache()
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        value = compute()
+        cache.set(key, value, get_ttl(cache))
+    return value
+
+
+def transaction_count(account):
+    return read_through(
+        account_key(account.pk, "transactions"),
+        lambda: account.transaction_set.count(),
+    )
+
+
+def latest_balance(account):
+    return read_through(
+        account_key(account.pk, "balance"),
+        account.compute_balance,
+    )
+
+
+def monthly_totals(account, month):
+    month = month_start(month)
+    return read_through(
+        account_key(account.pk, "totals", month.isoformat()),
+        lambda: compute_monthly_totals(account, month),
+    )
+
+
+def compute_monthly_totals(account, month):
+    # Amounts in different currencies can't be added up
+    return {
+        row.currency: {
+            "inflow": row.inflow,
+            "outflow": row.outflow,
+            "count": row.count,
+        }
+        for row in account.monthlyrollup_set.filter(month=month)
+    }
+
+
+def transaction_totals(transactions):
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+    for tr in transactions:
+        if tr.booking_date is None or tr.duplicate:
+            continue
+
+        amount, currency = tr.transaction_amount, tr.transaction_currency
+        if amount is None:
+            # Rows stored before amounts had their own column
+            amount, currency = Decimal(tr.amount), tr.currency
+
+        row = totals[month_start(tr.booking_date), currency]
+        row[0 if amount > 0 else 1] += abs(amount)
+        row[2] += 1
+    return totals
+
+
+def transactions_added(account_id, transactions):
+    try:
+        get_cache().incr(account_key(account_id, "transactions"), len(transactions))
+    except ValueError:
+        pass  # not cached
+
+    months_changed(
+        account_id, {tr.booking_date for tr in transactions if tr.booking_date}
+    )
+
+
+def months_changed(account_id, days):
+    months = {month_start(day) for day in days}
+    get_cache().delete_many(
+        [account_key(account_id, "totals", month.isoformat()) for month in months]
+    )
+
+
+def transactions_removed(account_ids):
+    get_cache().delete_many(
+        [account_key(account_id, "transactions") for account_id in account_ids]
+    )
+
+
+def balances_changed(account_id):
+    get_cache().delete(account_key(account_id, "balance"))
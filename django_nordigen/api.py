@@ -1,31 +1,114 @@
 import logging
-from datetime import date, timedelta
+import math
+import threading
+from datetime import timedelta
+from functools import partial
+from itertools import islice
 from urllib.parse import urljoin
-from uuid import uuid4
+from uuid import UUID, uuid4
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import Max, Q, Sum
 from django.urls import reverse
 from django.utils import timezone
-from nordigen import NordigenClient
-
-from .models import Account, Institution, Integration, Token, Transaction
+from django.utils.dateparse import parse_datetime
+
+from . import aggregates
+from .compression import archive_responses_enabled, compact_payloads_enabled
+from .fingerprint import with_transaction_ids
+from .models import (
+    INTERACTIVE_PRIORITIES,
+    Account,
+    AccountSyncResult,
+    ArchivedTransaction,
+    Balance,
+    Institution,
+    InstitutionCatalog,
+    Integration,
+    MonthlyRollup,
+    PayloadDictionary,
+    SyncPriority,
+    SyncRequest,
+    Token,
+    Transaction,
+    TransactionResponse,
+)
+from .response_cache import get_response_cache
 
 logger = logging.getLogger(__name__)
 
 ALL_REQUISITIONS = object()
 
+DEFAULT_INSTITUTION_TTL = 24 * 3600
+
+TOKEN_REFRESH_INTERVAL = timedelta(minutes=10)
+TOKEN_REFRESH_MARGIN = timedelta(hours=1)
+
+DEFAULT_SYNC_DEBOUNCE = 60
+DEFAULT_SYNC_MAX_DELAY = 600
+DEFAULT_SYNC_MAX_ATTEMPTS = 5
+SYNC_RETRY_DELAY = timedelta(minutes=1)
+SYNC_REQUEST_INTERVAL = timedelta(seconds=10)
+SYNC_REQUEST_LEASE = timedelta(hours=1)
+TRANSACTION_WINDOW = timedelta(days=30)
+STREAM_BATCH_SIZE = 1000
+
+
+def get_credentials():
+    credentials = {
+        str(UUID(str(nordigen_id))): secret_key
+        for nordigen_id, secret_key in getattr(
+            settings, "NORDIGEN_CREDENTIALS", {}
+        ).items()
+    }
+    if getattr(settings, "NORDIGEN_ID", None):
+        credentials.setdefault(
+            str(UUID(str(settings.NORDIGEN_ID))), settings.NORDIGEN_KEY
+        )
+    return credentials
 
-def get_client(integration):
-    client = NordigenClient(
+
+def get_secret_key(integration):
+    try:
+        return get_credentials()[str(integration.nordigen_id)]
+    except KeyError:
+        raise ImproperlyConfigured(f"No Nordigen secret key for {integration}")
+
+
+def build_client(integration):
+    # The SDK and its HTTP stack are slow to import, so only load them when
+    # a client is actually needed
+    from .client import Client
+
+    options = {}
+    if getattr(settings, "NORDIGEN_BASE_URL", None):
+        options["base_url"] = settings.NORDIGEN_BASE_URL
+
+    client = Client(
         secret_id=str(integration.nordigen_id),
-        secret_key=settings.NORDIGEN_KEY,
+        secret_key=get_secret_key(integration),
         timeout=60,
+        **options,
     )
+    client.response_cache = get_response_cache()
+    return client
+
+
+def refresh_tokens(integration, margin=timedelta(0), client=None):
+    client = client or build_client(integration)
+    with transaction.atomic():
+        # Lock the integration's tokens so only one process renews them
+        Integration.objects.select_for_update().get(pk=integration.pk)
+        list(integration.token_set.select_for_update())
+
+        access_token = integration.get_token(Token.TokenType.ACCESS, margin)
+        if access_token is not None:
+            return access_token
 
-    access_token = integration.get_token(Token.TokenType.ACCESS)
-    if access_token is None:
         logger.info("No valid access token found; getting one ...")
-        refresh_token = integration.get_token(Token.TokenType.REFRESH)
+        refresh_token = integration.get_token(Token.TokenType.REFRESH, margin)
 
         if refresh_token is None:
             logger.info("No valid refresh token found; getting one ...")
@@ -52,19 +135,80 @@ def get_client(integration):
             )
             logger.info("Got access token")
 
+    return access_token
+
+
+def get_client(integration):
+    client = build_client(integration)
+    if client.response_cache and client.response_cache.replay:
+        return client
+
+    access_token = integration.get_token(Token.TokenType.ACCESS)
+    if access_token is None:
+        access_token = refresh_tokens(integration, client=client)
+
     client.token = access_token.value
     return client
 
 
+def refresh_all_tokens(margin=TOKEN_REFRESH_MARGIN):
+    for integration in get_integrations():
+        try:
+            refresh_tokens(integration, margin)
+        except Exception:
+            logger.exception("Error refreshing tokens for %s", integration)
+
+
+class TokenRefresher(threading.Thread):
+    def __init__(self, interval=TOKEN_REFRESH_INTERVAL, margin=TOKEN_REFRESH_MARGIN):
+        super().__init__(name="nordigen-token-refresher", daemon=True)
+        self.interval = interval
+        self.margin = margin
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                refresh_all_tokens(self.margin)
+            except Exception:
+                logger.exception("Error refreshing tokens")
+            finally:
+                close_old_connections()
+            self.stopped.wait(self.interval.total_seconds())
+
+    def stop(self):
+        self.stopped.set()
+
+
+def get_institution_ttl():
+    return timedelta(
+        seconds=getattr(settings, "NORDIGEN_INSTITUTION_TTL", DEFAULT_INSTITUTION_TTL)
+    )
+
+
 def get_or_create_institution(client, nordigen_id):
-    try:
-        return Institution.objects.get(nordigen_id=nordigen_id)
-    except Institution.DoesNotExist:
-        api_data = client.institution.get_institution_by_id(nordigen_id)
-        return Institution.objects.create(
-            nordigen_id=nordigen_id,
-            api_data=api_data,
-        )
+    institution = Institution.objects.filter(nordigen_id=nordigen_id).first()
+    if institution and institution.updated_at > timezone.now() - get_institution_ttl():
+        return institution
+
+    api_data = client.institution.get_institution_by_id(nordigen_id)
+    institution, _ = Institution.objects.update_or_create(
+        nordigen_id=nordigen_id,
+        defaults=dict(api_data=api_data),
+    )
+    return institution
+
+
+def save_institutions(catalog):
+    return Institution.objects.bulk_create(
+        [
+            Institution(nordigen_id=api_data["id"], api_data=api_data)
+            for api_data in catalog
+        ],
+        update_conflicts=True,
+        unique_fields=["nordigen_id"],
+        update_fields=["api_data", "updated_at"],
+    )
 
 
 class Api:
@@ -72,8 +216,43 @@ class Api:
         self.integration = integration
         self.client = client
 
-    def get_institutions(self, country):
-        return self.client.institution.get_institutions(country=country)
+    @property
+    def request_count(self):
+        return getattr(self.client, "request_count", 0)
+
+    @property
+    def streaming(self):
+        # Archiving and the response cache need the whole response
+        return (
+            getattr(settings, "NORDIGEN_STREAM_TRANSACTIONS", False)
+            and not archive_responses_enabled()
+            and getattr(self.client, "response_cache", None) is None
+        )
+
+    def get_institutions(self, country, refresh=False):
+        catalog = InstitutionCatalog.objects.filter(
+            country=country,
+            synced_at__gt=timezone.now() - get_institution_ttl(),
+        )
+        if refresh or not catalog.exists():
+            return self.sync_institutions(country)
+
+        return [
+            institution.api_data
+            for institution in Institution.objects.order_by("nordigen_id")
+            if country in institution.countries
+        ]
+
+    def sync_institutions(self, country):
+        logger.info("Fetching institution catalog for %s", country)
+        catalog = self.client.institution.get_institutions(country=country)
+        save_institutions(catalog)
+        InstitutionCatalog.objects.update_or_create(
+            country=country,
+            defaults=dict(synced_at=timezone.now()),
+        )
+        logger.info("Saved %d institutions for %s", len(catalog), country)
+        return catalog
 
     def get_institution_data(self, nordigen_id):
         return self.client.institution.get_institution_by_id(nordigen_id)
@@ -100,78 +279,309 @@ class Api:
         return session.link
 
     def accept_requisition(self, requisition):
-        self.sync_requisition(requisition)
+        self.sync_requisition(requisition, force=True)
         requisition.completed = True
         requisition.save(update_fields=["completed"])
 
-    def sync_requisition(self, requisition):
+    def sync_requisition(self, requisition, force=False):
         api_data = self.client.requisition.get_requisition_by_id(
             requisition_id=requisition.nordigen_id
         )
-        if api_data != requisition.api_data:
+        changed = []
+        unchanged = api_data == requisition.api_data
+        if not unchanged:
             logger.info("Requisition data updated for %s", requisition)
             requisition.api_data = api_data
-            requisition.save(update_fields=["api_data"])
+            changed.append("api_data")
+
+        status = api_data.get("status", "")
+        if status != requisition.status:
+            requisition.status = status
+            changed.append("status")
+
+        if requisition.expires_at is None:
+            requisition.expires_at = self.get_requisition_expiry(requisition)
+            if requisition.expires_at:
+                changed.append("expires_at")
+
+        if changed:
+            requisition.save(update_fields=changed)
+
+        if requisition.is_dead(timezone.now()):
+            requisition.deactivate()
+            return
+
+        account_ids = {UUID(account_id) for account_id in api_data["accounts"]}
+        linked = set(requisition.account_set.values_list("nordigen_id", flat=True))
+        if unchanged and account_ids == linked and not force:
+            logger.debug("Requisition %s unchanged", requisition)
+            return
+
+        accounts = [
+            self.sync_account_metadata(requisition, account_id)
+            for account_id in api_data["accounts"]
+        ]
+        Link = Account.requisitions.through
+        Link.objects.bulk_create(
+            [Link(account=account, requisition=requisition) for account in accounts],
+            ignore_conflicts=True,
+        )
 
-        for account_id in requisition.api_data["accounts"]:
-            account_api = self.client.account_api(id=account_id)
-            api_data = account_api.get_metadata()
-            api_details = account_api.get_details()
+    def sync_account_metadata(self, requisition, account_id):
+        account_api = self.client.account_api(id=account_id)
+        api_data = account_api.get_metadata()
+        api_details = account_api.get_details()
 
-            try:
-                account = self.integration.account_set.get(nordigen_id=account_id)
-
-            except Account.DoesNotExist:
-                account = self.integration.account_set.create(
-                    institution=requisition.institution,
-                    nordigen_id=account_id,
-                    api_data=api_data,
-                    api_details=api_details,
-                )
-                logger.info("Account %s created", account)
+        try:
+            account = self.integration.account_set.with_payload().get(
+                nordigen_id=account_id
+            )
 
-            else:
-                changed = []
+        except Account.DoesNotExist:
+            account = self.integration.account_set.create(
+                institution=requisition.institution,
+                nordigen_id=account_id,
+                api_data=api_data,
+                api_details=api_details,
+            )
+            logger.info("Account %s created", account)
 
-                if dict(api_data, last_accessed=None) != dict(
-                    account.api_data, last_accessed=None
-                ):
-                    changed.append("api_data")
-                    account.api_data = api_data
+        else:
+            changed = []
+
+            if dict(api_data, last_accessed=None) != dict(
+                account.api_data, last_accessed=None
+            ):
+                changed.append("api_data")
+                account.api_data = api_data
+
+            if api_details != account.api_details:
+                changed.append("api_details")
+                account.api_details = api_details
 
-                if api_details != account.api_details:
-                    changed.append("api_details")
-                    account.api_details = api_details
+            if changed:
+                logger.info("Account fields for %s changed: %s", account, changed)
+                account.save(update_fields=changed)
 
-                if changed:
-                    logger.info("Account fields for %s changed: %s", account, changed)
-                    account.save(update_fields=changed)
+        return account
 
-            account.requisitions.add(requisition)
+    def get_requisition_expiry(self, requisition):
+        agreement_id = requisition.api_data.get("agreement")
+        if not agreement_id:
+            return None
 
-    def sync(self, requisitions, max_age, history, transactions=True):
+        agreement = self.client.agreement.get_agreement_by_id(agreement_id)
+        accepted = agreement.get("accepted") and parse_datetime(agreement["accepted"])
+        if not accepted:
+            return None
+
+        return accepted + timedelta(days=int(agreement["access_valid_for_days"]))
+
+    def sync(self, requisitions, max_age, history, transactions=True, priority=None):
+        if priority is None:
+            priority = SyncPriority.BACKFILL if history else SyncPriority.SCHEDULED
         now = timezone.now()
+        sync_run = self.integration.syncrun_set.create(
+            started_at=now,
+            max_age=max_age,
+            history=history,
+            priority=priority,
+        )
+        calls_before = self.request_count
+        try:
+            for requisition in self.integration.requisition_set.filter(active=True):
+                if (
+                    requisitions is ALL_REQUISITIONS
+                    or requisition.nordigen_id in requisitions
+                ):
+                    if requisition.is_dead(now):
+                        requisition.deactivate()
+                        continue
+
+                    try:
+                        self.sync_requisition(requisition)
+                        if not requisition.active:
+                            continue
+
+                        for account in requisition.account_set.exclude(
+                            synced_at__gt=now - max_age
+                        ):
+                            if self.defer(
+                                account,
+                                priority,
+                                history,
+                                self.request_count - calls_before,
+                            ):
+                                continue
+                            try:
+                                self._sync_account_recorded(
+                                    sync_run, account, history, transactions
+                                )
+                            except Exception:
+                                logger.error("Error syncing account %r", account)
+                                raise
+
+                    except Exception:
+                        logger.error("Error syncing requisition %r", requisition)
+                        raise
+
+        except Exception as error:
+            sync_run.finish(self.request_count - calls_before, error)
+            raise
+
+        sync_run.finish(self.request_count - calls_before)
+
+    def sync_accounts(self, accounts, history=False, priority=SyncPriority.INTERACTIVE):
+        sync_run = self.integration.syncrun_set.create(
+            history=history, priority=priority
+        )
+        calls_before = self.request_count
+        try:
+            for account in accounts:
+                if self.defer(
+                    account, priority, history, self.request_count - calls_before
+                ):
+                    continue
+                self._sync_account_recorded(sync_run, account, history, True)
+
+        except Exception as error:
+            sync_run.finish(self.request_count - calls_before, error)
+            raise
+
+        sync_run.finish(self.request_count - calls_before)
+
+    def defer(self, account, priority, history, run_calls=0):
+        # Background lanes give way to waiting interactive requests, and leave
+        # the end of the daily request budget to them. run_calls are the
+        # requests of the current run, not yet saved on its SyncRun.
+        if priority in INTERACTIVE_PRIORITIES:
+            return False
+
+        try:
+            process_sync_requests(priorities=INTERACTIVE_PRIORITIES)
+        except Exception:
+            logger.exception("Error processing interactive sync requests")
+
+        if request_budget_reserved(self.integration, run_calls):
+            logger.info("Request budget reserved, deferring %s to tomorrow", account)
+            tomorrow = timezone.localtime().replace(
+                hour=0, minute=0, second=0, microsecond=0
+            ) + timedelta(days=1)
+            request_sync([account], priority, history, not_before=tomorrow)
+            return True
+
+        return False
+
+    def _sync_account_recorded(self, sync_run, account, history, transactions):
+        result = sync_run.accountsyncresult_set.create(account=account)
+        calls_before = self.request_count
+        try:
+            result.transactions_created = self.sync_account(
+                account, history, transactions
+            )
+
+        except Exception as error:
+            result.finish(self.request_count - calls_before, error)
+            raise
+
+        result.finish(self.request_count - calls_before)
+        sync_run.transactions_created += result.transactions_created
+
+    def plan(self, requisitions, max_age, history, transactions=True):
+        # Mirrors sync() without network calls, estimating its request count
+        now = timezone.now()
+        rows = []
         for requisition in self.integration.requisition_set.filter(active=True):
             if (
-                requisitions is ALL_REQUISITIONS
-                or requisition.nordigen_id in requisitions
+                requisitions is not ALL_REQUISITIONS
+                and requisition.nordigen_id not in requisitions
             ):
-                try:
-                    self.sync_requisition(requisition)
-                    for account in requisition.account_set.exclude(
-                        synced_at__gt=now - max_age
-                    ):
-                        try:
-                            self.sync_account(account, history, transactions)
-                        except Exception:
-                            logger.error("Error syncing account %r", account)
-                            raise
-
-                except Exception:
-                    logger.error("Error syncing requisition %r", requisition)
-                    raise
-
-    def iter_transactions(self, account, since, interval=timedelta(days=30)):
+                continue
+            if requisition.is_dead(now):
+                continue
+
+            # One call for the requisition, one for a missing agreement expiry,
+            # two per listed account when any of them is not linked yet. A
+            # requisition never fetched has accounts that can't be counted.
+            requests = 1 + (requisition.expires_at is None)
+            listed = (requisition.api_data or {}).get("accounts", [])
+            accounts = list(requisition.account_set.all())
+            linked = {str(account.nordigen_id) for account in accounts}
+            missing = [account_id for account_id in listed if account_id not in linked]
+            if missing:
+                requests += 2 * len(listed)
+            rows.append(
+                {
+                    "requisition": requisition,
+                    "account": None,
+                    "windows": 0,
+                    "requests": requests,
+                    "unknown": requisition.api_data is None,
+                }
+            )
+
+            # Accounts are linked during the sync; those not stored at all
+            # start with no transactions
+            existing = {
+                str(account.nordigen_id): account
+                for account in self.integration.account_set.filter(
+                    nordigen_id__in=missing
+                )
+            }
+            accounts += existing.values()
+            for account in accounts:
+                if account.synced_at and account.synced_at > now - max_age:
+                    continue
+                windows = 0
+                if transactions:
+                    since = self.get_since(account, history, now)
+                    windows = self.count_windows(account, since, now.date())
+                rows.append(
+                    {
+                        "requisition": requisition,
+                        "account": account,
+                        "windows": windows,
+                        "requests": 1 + windows,
+                    }
+                )
+
+            for account_id in missing:
+                if account_id in existing:
+                    continue
+                windows = 0
+                if transactions:
+                    days = requisition.max_historical_days if history else 30
+                    since = now.date() - timedelta(days=days)
+                    windows = window_count(since - timedelta(days=1), now.date())
+                rows.append(
+                    {
+                        "requisition": requisition,
+                        "account": account_id,
+                        "windows": windows,
+                        "requests": 1 + windows,
+                    }
+                )
+        return rows
+
+    def count_windows(self, account, since, today, interval=TRANSACTION_WINDOW):
+        # Same start date as fetch_transactions, then same windows as
+        # iter_transactions
+        latest = [
+            queryset.aggregate(latest=Max("booking_date"))["latest"]
+            for queryset in [
+                account.transaction_set,
+                account.archivedtransaction_set.filter(
+                    booking_date__gte=since - timedelta(days=1)
+                ),
+            ]
+        ]
+        date_from = max([since, *filter(None, latest)])
+        if account.resume_since and account.resume_since < date_from:
+            date_from = account.resume_since
+        date_from -= timedelta(days=1)
+        return window_count(date_from, today, interval)
+
+    def iter_transactions(self, account, since, interval=TRANSACTION_WINDOW):
         account_api = self.client.account_api(id=account.nordigen_id)
         now = timezone.now().date()
 
@@ -184,11 +594,22 @@ class Api:
                 date_from,
                 date_to,
             )
-            resp = account_api.get_transactions(date_from=date_from, date_to=date_to)
-            for api_data in resp["transactions"]["booked"]:
-                nordigen_id = api_data.get("internalTransactionId")
-                if nordigen_id:
-                    yield nordigen_id, api_data
+            if self.streaming:
+                booked = (
+                    api_data
+                    for status, api_data in self.client.stream_transactions(
+                        account.nordigen_id, date_from, date_to
+                    )
+                    if status == "booked"
+                )
+            else:
+                resp = account_api.get_transactions(
+                    date_from=date_from, date_to=date_to
+                )
+                if archive_responses_enabled():
+                    TransactionResponse.archive(account, date_from, date_to, resp)
+                booked = resp["transactions"]["booked"]
+            yield from with_transaction_ids(booked)
 
             date_from = date_to
 
@@ -197,65 +618,384 @@ class Api:
         logger.info("Fetching balances from %s", account.nordigen_id)
         return account_api.get_balances()["balances"]
 
-    def _sync_transactions(self, account, since):
+    def save_balances(self, account, balances, now):
+        existing = {
+            balance.type: balance.api_data
+            for balance in account.balance_set.with_payload()
+        }
+        changed = [
+            Balance(
+                account=account,
+                type=api_data["balanceType"],
+                api_data=api_data,
+                synced_at=now,
+            )
+            for api_data in balances
+            if existing.get(api_data["balanceType"]) != api_data
+        ]
+        if changed:
+            Balance.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=["account", "type"],
+                update_fields=["api_data", "synced_at", "updated_at"],
+            )
+            logger.info("Updated %d balances", len(changed))
+            transaction.on_commit(lambda: aggregates.balances_changed(account.pk))
+
+    def fetch_transactions(self, account, since):
+        new, last_pk, _ = self.new_transactions(account, since)
+        return list(new), last_pk
+
+    def new_transactions(self, account, since):
+        # The rows are fetched from the API as the generator is consumed
         seen = set()
-        for tr in account.transaction_set.all():
-            seen.add(tr.nordigen_id)
-            if tr.booking_date and tr.booking_date > since:
-                since = tr.booking_date
-
-        new = []
-        for nordigen_id, api_data in self.iter_transactions(
-            account, since - timedelta(days=1)
+        last_pk = 0
+        for pk, nordigen_id, booking_date in account.transaction_set.values_list(
+            "pk", "nordigen_id", "booking_date"
         ):
-            if nordigen_id in seen:
-                continue
-            bookingDate = api_data.get("bookingDate")
-            booking_date = bookingDate and date.fromisoformat(bookingDate)
-            new.append(
-                Transaction(
-                    account=account,
-                    nordigen_id=nordigen_id,
-                    api_data=api_data,
-                    booking_date=booking_date,
+            seen.add(nordigen_id)
+            last_pk = max(last_pk, pk)
+            if booking_date and booking_date > since:
+                since = booking_date
+
+        for nordigen_id, booking_date in account.archivedtransaction_set.filter(
+            booking_date__gte=since - timedelta(days=1)
+        ).values_list("nordigen_id", "booking_date"):
+            seen.add(nordigen_id)
+            if booking_date > since:
+                since = booking_date
+
+        if account.resume_since and account.resume_since < since:
+            since = account.resume_since
+
+        # Only copies of an earlier sibling's transactions are duplicates;
+        # identical transactions on one account are all real
+        fingerprints = set()
+        for model in [Transaction, ArchivedTransaction]:
+            fingerprints.update(
+                model.objects.filter(
+                    account__in=account.siblings().filter(pk__lt=account.pk),
+                    booking_date__gte=since - timedelta(days=1),
+                ).values_list("fingerprint", flat=True)
+            )
+
+        compressor = None
+        if compact_payloads_enabled():
+            compressor = PayloadDictionary.get_compressor(account.institution_id)
+
+        def rows():
+            for nordigen_id, api_data in self.iter_transactions(
+                account, since - timedelta(days=1)
+            ):
+                if nordigen_id in seen:
+                    continue
+                yield Transaction.from_api(
+                    account, nordigen_id, api_data, compressor, fingerprints
                 )
+                seen.add(nordigen_id)
+
+        return rows(), last_pk, since
+
+    def save_streamed_transactions(self, account, since):
+        # Saves while the response downloads, in batches that each hold the
+        # account lock briefly, so memory doesn't grow with the response.
+        # Until the whole stream is saved, the next sync starts over from the
+        # same date rather than from the latest saved row.
+        rows, last_pk, resume_since = self.new_transactions(account, since)
+        created = 0
+        while True:
+            batch = list(islice(rows, STREAM_BATCH_SIZE))
+            if not batch:
+                break
+            with transaction.atomic():
+                if account.resume_since != resume_since:
+                    account.resume_since = resume_since
+                    account.save(update_fields=["resume_since"])
+                created += len(self.save_transactions(account, batch, last_pk))
+
+        if account.resume_since is not None:
+            account.resume_since = None
+            account.save(update_fields=["resume_since"])
+        return created
+
+    def save_transactions(self, account, new, last_pk):
+        if not new:
+            return new
+
+        # Must run in a transaction, the lock serializes writers per account
+        Account.objects.select_for_update().filter(pk=account.pk).exists()
+        ids = [tr.nordigen_id for tr in new]
+        stored = set()
+        for start in range(0, len(ids), STREAM_BATCH_SIZE):
+            stored.update(
+                account.transaction_set.filter(
+                    pk__gt=last_pk, nordigen_id__in=ids[start:][:STREAM_BATCH_SIZE]
+                ).values_list("nordigen_id", flat=True)
             )
-            seen.add(nordigen_id)
+        if stored:
+            logger.info("Skipping transactions stored by another worker")
+            new = [tr for tr in new if tr.nordigen_id not in stored]
 
         Transaction.objects.bulk_create(new)
         if new:
             logger.info("Created %d transactions", len(new))
+            MonthlyRollup.add(account, new)
+            transaction.on_commit(
+                lambda: aggregates.transactions_added(account.pk, new)
+            )
+            self.flag_duplicates(account, new)
+        return new
+
+    def flag_duplicates(self, account, new):
+        dated = [tr for tr in new if tr.booking_date and not tr.duplicate]
+        if not dated:
+            return
+
+        changed = account.flag_duplicates(
+            {tr.fingerprint for tr in dated}, min(tr.booking_date for tr in dated)
+        )
+        for sibling_id, months in changed.items():
+            logger.info("Flagged duplicates on account %s", sibling_id)
+            transaction.on_commit(
+                partial(aggregates.months_changed, sibling_id, months)
+            )
+
+    def _sync_transactions(self, account, since):
+        if self.streaming:
+            return self.save_streamed_transactions(account, since)
+
+        new, last_pk = self.fetch_transactions(account, since)
+        with transaction.atomic():
+            new = self.save_transactions(account, new, last_pk)
+            account.resume_since = None
+            account.save(update_fields=["resume_since"])
+        return len(new)
+
+    def get_since(self, account, history, now):
+        if history:
+            req = account.requisitions.order_by("-created_at").first()
+            return now.date() - timedelta(days=req.max_historical_days)
+
+        return now.date() - timedelta(days=30)
 
     def sync_account(self, account, history, transactions=True):
         logger.info("Sync account %s", account)
         now = timezone.now()
 
-        for api_data in self.get_balances(account):
-            account.balance_set.update_or_create(
-                type=api_data["balanceType"],
-                defaults=dict(
-                    api_data=api_data,
-                    synced_at=now,
-                ),
-            )
-
+        # Fetch everything first, so no locks are held during HTTP calls
+        balances = self.get_balances(account)
+        new, last_pk, created = [], 0, 0
         if transactions:
-            if history:
-                req = account.requisitions.order_by("-created_at").first()
-                since = now.date() - timedelta(days=req.max_historical_days)
-
+            since = self.get_since(account, history, now)
+            if self.streaming:
+                created = self.save_streamed_transactions(account, since)
             else:
-                since = now.date() - timedelta(days=30)
+                new, last_pk = self.fetch_transactions(account, since)
 
-            self._sync_transactions(account, since)
+        with transaction.atomic():
+            new = self.save_transactions(account, new, last_pk)
+            self.save_balances(account, balances, now)
+            account.synced_at = now
+            if transactions:
+                account.resume_since = None
+            account.save(update_fields=["synced_at", "resume_since"])
 
-        account.synced_at = now
-        account.save(update_fields=["synced_at"])
+        return created + len(new)
 
 
-def get_api():
-    integration, _ = Integration.objects.get_or_create(
-        nordigen_id=settings.NORDIGEN_ID,
-    )
+def get_integrations(nordigen_ids=None, shard=None):
+    nordigen_ids = nordigen_ids or [UUID(key) for key in get_credentials()]
+    if shard is not None:
+        index, count = shard
+        nordigen_ids = [uuid for uuid in nordigen_ids if uuid.int % count == index]
+
+    return [
+        Integration.objects.get_or_create(nordigen_id=nordigen_id)[0]
+        for nordigen_id in nordigen_ids
+    ]
+
+
+def get_api(integration=None):
+    if integration is None:
+        integration, _ = Integration.objects.get_or_create(
+            nordigen_id=settings.NORDIGEN_ID,
+        )
 
     return Api(integration, get_client(integration))
+
+
+def window_count(date_from, today, interval=TRANSACTION_WINDOW):
+    return max(0, math.ceil((today - date_from) / interval))
+
+
+def get_request_seconds(recent=100):
+    totals = AccountSyncResult.objects.filter(
+        status=AccountSyncResult.Status.SUCCESS, api_calls__gt=0
+    )[:recent].aggregate(duration=Sum("duration"), api_calls=Sum("api_calls"))
+    if totals["api_calls"]:
+        return totals["duration"].total_seconds() / totals["api_calls"]
+
+
+def get_requests_today(integration):
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (
+        integration.syncrun_set.filter(started_at__gte=today).aggregate(
+            api_calls=Sum("api_calls")
+        )["api_calls"]
+        or 0
+    )
+
+
+def request_budget_reserved(integration, pending=0):
+    limit = getattr(settings, "NORDIGEN_DAILY_REQUEST_LIMIT", None)
+    if limit is None:
+        return False
+    reserve = getattr(settings, "NORDIGEN_INTERACTIVE_RESERVE", 0)
+    return get_requests_today(integration) + pending >= limit - reserve
+
+
+def request_sync(
+    accounts,
+    priority=SyncPriority.INTERACTIVE,
+    history=False,
+    not_before=None,
+    attempts=0,
+):
+    # Bursts collapse into one row per account, keeping the most urgent
+    # priority. Each request pushes the sync back by the debounce delay, but
+    # never past max delay after the first. Onboarding is not debounced. A
+    # less urgent request never pushes back a more urgent one, nor changes
+    # whether it fetches history. A request never cuts short a retry backoff.
+    accounts = list(accounts)
+    if not_before is None:
+        debounce = getattr(settings, "NORDIGEN_SYNC_DEBOUNCE", DEFAULT_SYNC_DEBOUNCE)
+        if priority == SyncPriority.ONBOARDING:
+            debounce = 0
+        not_before = timezone.now() + timedelta(seconds=debounce)
+
+    existing = {
+        request.account_id: request
+        for request in SyncRequest.objects.filter(account__in=accounts)
+    }
+    requests = []
+    for account in accounts:
+        request = SyncRequest(
+            account=account,
+            not_before=not_before,
+            priority=priority,
+            history=history,
+            attempts=attempts,
+        )
+        if account.pk in existing:
+            other = existing[account.pk]
+            if other.priority < priority:
+                request.not_before = other.not_before
+                request.history = other.history
+            elif other.priority == priority:
+                request.history = history or other.history
+            if other.attempts:
+                request.not_before = max(request.not_before, other.not_before)
+            request.priority = min(priority, other.priority)
+            request.attempts = max(attempts, other.attempts)
+        requests.append(request)
+
+    SyncRequest.objects.bulk_create(
+        requests,
+        update_conflicts=True,
+        unique_fields=["account"],
+        update_fields=["not_before", "priority", "history", "attempts", "updated_at"],
+    )
+
+
+def retry_sync_requests(requests):
+    # Failed requests are queued again with exponential backoff, and dropped
+    # after NORDIGEN_SYNC_MAX_ATTEMPTS failures
+    max_attempts = getattr(
+        settings, "NORDIGEN_SYNC_MAX_ATTEMPTS", DEFAULT_SYNC_MAX_ATTEMPTS
+    )
+    now = timezone.now()
+    for request in requests:
+        attempts = request.attempts + 1
+        if attempts >= max_attempts:
+            logger.warning(
+                "Dropping sync request for %s after %d failed attempts",
+                request.account,
+                attempts,
+            )
+            continue
+        request_sync(
+            [request.account],
+            request.priority,
+            request.history,
+            not_before=now + SYNC_RETRY_DELAY * 2 ** (attempts - 1),
+            attempts=attempts,
+        )
+
+
+def release_sync_requests(requests):
+    # Requests made again while the sync ran stay queued
+    claimed = {request.pk: request.updated_at for request in requests}
+    with transaction.atomic():
+        done = [
+            pk
+            for pk, updated_at in SyncRequest.objects.select_for_update()
+            .filter(pk__in=claimed)
+            .values_list("pk", "updated_at")
+            if updated_at == claimed[pk]
+        ]
+        SyncRequest.objects.filter(pk__in=done).delete()
+
+
+def process_sync_requests(limit=100, priorities=None):
+    now = timezone.now()
+    max_delay = timedelta(
+        seconds=getattr(settings, "NORDIGEN_SYNC_MAX_DELAY", DEFAULT_SYNC_MAX_DELAY)
+    )
+    debounce = timedelta(
+        seconds=getattr(settings, "NORDIGEN_SYNC_DEBOUNCE", DEFAULT_SYNC_DEBOUNCE)
+    )
+    # The max delay caps debouncing only; requests deferred further ahead,
+    # e.g. to the next day's request budget, wait for their time
+    due = SyncRequest.objects.filter(
+        Q(not_before__lte=now)
+        | Q(created_at__lte=now - max_delay, not_before__lte=now + debounce)
+    )
+    if priorities is not None:
+        due = due.filter(priority__in=priorities)
+
+    with transaction.atomic():
+        due = list(
+            due.select_for_update(skip_locked=True, of=("self",))
+            .select_related("account__integration")
+            .order_by("priority", "created_at")[:limit]
+        )
+        # Claimed requests stay queued until their sync is done; if the
+        # worker dies, they are taken again once the lease runs out
+        SyncRequest.objects.filter(pk__in=[request.pk for request in due]).update(
+            not_before=now + SYNC_REQUEST_LEASE
+        )
+
+    # Most urgent lane first; dicts keep insertion order
+    batches = {}
+    for request in due:
+        key = request.priority, request.history, request.account.integration
+        batches.setdefault(key, []).append(request)
+
+    # A failed batch is retried later; the others still run
+    error = None
+    for (priority, history, integration), requests in batches.items():
+        accounts = [request.account for request in requests]
+        try:
+            get_api(integration).sync_accounts(accounts, history, priority)
+        except Exception as batch_error:
+            logger.exception("Error syncing requested accounts of %s", integration)
+            release_sync_requests(requests)
+            retry_sync_requests(requests)
+            error = error or batch_error
+        else:
+            release_sync_requests(requests)
+
+    if error is not None:
+        raise error
+    return len(due)
@@ -0,0 +1,92 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections, transaction
+
+from .compression import parse_amount
+from .fingerprint import transaction_fingerprint
+from .models import ArchivedTransaction, Transaction
+
+BACKFILLS = {}
+
+
+def process_pool(workers):
+    # Forked workers must open their own database connections, and spawned
+    # ones must set up Django first
+    connections.close_all()
+    return ProcessPoolExecutor(workers, initializer=django.setup)
+
+
+def register(cls):
+    BACKFILLS[cls.name] = cls
+    return cls
+
+
+# A data migration that can run online: rows are processed in primary key
+# ranges, each range in its own short transaction, and process() must be
+# safe to run twice on the same row.
+class Backfill:
+    name = None
+    model = None
+    fields = []
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def process(self, obj):
+        raise NotImplementedError
+
+    def run_range(self, start, end):
+        rows = self.get_queryset().filter(pk__gte=start, pk__lt=end)
+        changed = [obj for obj in rows if self.process(obj)]
+        with transaction.atomic():
+            self.model.objects.bulk_update(changed, self.fields)
+        return len(changed)
+
+
+def run_range(name, start, end, sleep=0):
+    try:
+        changed = BACKFILLS[name]().run_range(start, end)
+        if sleep:
+            time.sleep(sleep)
+        return changed
+
+    finally:
+        connections.close_all()
+
+
+@register
+class TransactionFingerprints(Backfill):
+    name = "transaction-fingerprints"
+    model = Transaction
+    fields = ["fingerprint"]
+
+    def get_queryset(self):
+        return self.model.objects.with_payload().filter(fingerprint="")
+
+    def process(self, tr):
+        tr.fingerprint = transaction_fingerprint(tr.data)
+        return True
+
+
+@register
+class ArchivedTransactionFingerprints(TransactionFingerprints):
+    name = "archived-transaction-fingerprints"
+    model = ArchivedTransaction
+
+
+@register
+class TransactionAmounts(Backfill):
+    name = "transaction-amounts"
+    model = Transaction
+    fields = ["transaction_amount", "transaction_currency"]
+
+    def get_queryset(self):
+        return self.model.objects.with_payload().filter(
+            transaction_amount=None, api_data__isnull=False
+        )
+
+    def process(self, tr):
+        tr.transaction_amount, tr.transaction_currency = parse_amount(tr.api_data)
+        return tr.transaction_amount is not None
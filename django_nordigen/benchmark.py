@@ -0,0 +1,206 @@
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from uuid import uuid4
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client as TestClient
+from django.test import override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from .api import ALL_REQUISITIONS, get_api
+from .fake_api import FakeNordigenServer
+from .models import Account, Institution, Integration, Requisition, Transaction
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CHANGELISTS = ["account", "transaction", "balance", "requisition"]
+
+STARTUP_IMPORTS = [
+    "django_nordigen.management.commands.nordigen_sync",
+    "django_nordigen.client",
+]
+
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for module in sys.argv[1:]:
+    __import__(module)
+print(time.perf_counter() - start, "nordigen" in sys.modules)
+"""
+
+
+@contextmanager
+def measure(results, name, fake):
+    row = {"phase": name, "items": None, "error": None}
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    requests_before = fake.request_count
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(count_queries):
+            yield row
+
+    except Exception as error:
+        logger.exception("Benchmark phase %r failed", name)
+        row["error"] = repr(error)
+
+    finally:
+        row["seconds"] = time.perf_counter() - start
+        row["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        row["queries"] = queries
+        row["api_requests"] = fake.request_count - requests_before
+        results.append(row)
+
+
+def setup_data(fake):
+    integration = Integration.objects.create(nordigen_id=uuid4())
+    institution = Institution.objects.create(
+        nordigen_id=fake.institution_id(0),
+        api_data=fake.institution(fake.institution_id(0)),
+    )
+    Requisition.objects.bulk_create(
+        Requisition(
+            integration=integration,
+            nordigen_id=nordigen_id,
+            reference_id=uuid4(),
+            completed=True,
+            institution=institution,
+            max_historical_days=fake.history_days,
+        )
+        for nordigen_id in fake.requisition_ids()
+    )
+    return integration
+
+
+def run_benchmark(fake, admin=True, stream=False):
+    results = []
+    with FakeNordigenServer(fake) as server:
+        integration = setup_data(fake)
+        with override_settings(
+            NORDIGEN_BASE_URL=server.base_url,
+            NORDIGEN_ID=integration.nordigen_id,
+            NORDIGEN_KEY="benchmark",
+            NORDIGEN_STREAM_TRANSACTIONS=stream,
+            # The debug query log would hold every statement in memory
+            DEBUG=False,
+        ):
+            api = get_api()
+
+            with measure(results, "sync --history", fake) as row:
+                api.sync(ALL_REQUISITIONS, timedelta(0), history=True)
+                row["items"] = Transaction.objects.count()
+
+            with measure(results, "sync", fake) as row:
+                api.sync(ALL_REQUISITIONS, timedelta(0), history=False)
+                row["items"] = Account.objects.count()
+
+            with measure(results, "_sync_transactions", fake) as row:
+                since = timezone.now().date() - timedelta(days=fake.history_days)
+                row["items"] = 0
+                for account in Account.objects.all():
+                    api._sync_transactions(account, since)
+                    row["items"] += 1
+
+            if admin:
+                run_admin_benchmark(results, fake)
+
+    return results
+
+
+def run_admin_benchmark(results, fake):
+    client = TestClient()
+    client.force_login(
+        get_user_model().objects.create_superuser("benchmark", "", str(uuid4()))
+    )
+    for model_name in ADMIN_CHANGELISTS:
+        try:
+            url = reverse(f"admin:django_nordigen_{model_name}_changelist")
+        except NoReverseMatch:
+            logger.warning("Admin is not configured; skipping changelists")
+            return
+
+        with measure(results, f"admin {model_name} changelist", fake):
+            resp = client.get(url)
+            assert resp.status_code == 200, resp.status_code
+
+
+def measure_startup(runs=5):
+    # Fresh interpreters, so nothing is cached from the benchmark process
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    results = []
+    for imports in [[], *[[module] for module in STARTUP_IMPORTS]]:
+        timings = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT, *imports],
+                env=env,
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout.split()
+            timings.append(float(output[0]))
+        results.append(
+            {
+                "phase": " ".join(["django.setup()", *imports]),
+                "seconds": statistics.median(timings),
+                "sdk": output[1] == "True",
+            }
+        )
+    return results
+
+
+def format_startup(results):
+    width = max(len(row["phase"]) for row in results)
+    return "\n".join(
+        f"{row['phase'].ljust(width)}  {row['seconds']:.3f}s"
+        f"{'  (loads nordigen SDK)' if row['sdk'] else ''}"
+        for row in results
+    )
+
+
+def format_results(results):
+    header = ["phase", "seconds", "items/s", "api", "queries", "peak MiB"]
+    lines = [header]
+    errors = []
+    for row in results:
+        items = row["items"]
+        lines.append(
+            [
+                row["phase"],
+                f"{row['seconds']:.3f}",
+                f"{items / row['seconds']:.1f}" if items else "-",
+                str(row["api_requests"]),
+                str(row["queries"]),
+                f"{row['peak_memory'] / 2**20:.1f}",
+            ]
+        )
+        if row["error"]:
+            errors.append(f"{row['phase']}: {row['error']}")
+
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    table = [
+        "  ".join(
+            [line[0].ljust(widths[0])]
+            + [cell.rjust(width) for cell, width in zip(line[1:], widths[1:])]
+        )
+        for line in lines
+    ]
+    return "\n".join(table + errors)
@@ -0,0 +1,61 @@
+import requests
+from nordigen import NordigenClient
+from nordigen.types.http_enums import HTTPMethod
+from requests.exceptions import HTTPError
+
+from .response_cache import ResponseNotRecorded
+from .streaming import iter_transactions
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Client(NordigenClient):
+    request_count = 0
+    response_cache = None
+
+    def request(self, method, endpoint, data=None, headers=None):
+        if self.response_cache is None:
+            return self.send(method, endpoint, data, headers)
+
+        if method != HTTPMethod.GET:
+            if self.response_cache.replay:
+                raise ResponseNotRecorded(method, endpoint)
+            return self.send(method, endpoint, data, headers)
+
+        params = {
+            key: str(value)
+            for key, value in self.data_filter.filter_payload(data).items()
+        }
+        return self.response_cache.fetch(
+            endpoint, params, lambda: self.send(method, endpoint, data, headers)
+        )
+
+    def send(self, *args, **kwargs):
+        self.request_count += 1
+        return super().request(*args, **kwargs)
+
+    def stream(self, endpoint, data=None):
+        # Like a GET request, but yields the raw body in chunks
+        self.request_count += 1
+        response = requests.get(
+            f"{self.base_url}/{endpoint}",
+            headers=self._headers,
+            params=self.data_filter.filter_payload(data),
+            timeout=self._timeout,
+            stream=True,
+        )
+        with response:
+            if not response.ok:
+                raise HTTPError(
+                    {"response": response.json(), "status": response.status_code},
+                    response=response,
+                )
+            yield from response.iter_content(STREAM_CHUNK_SIZE)
+
+    def stream_transactions(self, account_id, date_from, date_to):
+        return iter_transactions(
+            self.stream(
+                f"accounts/{account_id}/transactions/",
+                {"date_from": date_from, "date_to": date_to},
+            )
+        )
@@ -0,0 +1,150 @@
+import json
+import zlib
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+# First byte of every compressed payload, so rows can be decoded regardless of
+# what NORDIGEN_PAYLOAD_COMPRESSION is set to today.
+PREFIXES = {
+    ZLIB: b"z",
+    ZSTD: b"Z",
+}
+
+ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Key in the stored remainder listing which payload keys were moved to columns
+STRIPPED_KEY = "~"
+STRIPPED = {
+    "i": "internalTransactionId",
+    "b": "bookingDate",
+    "a": "transactionAmount",
+}
+
+
+def compact_payloads_enabled():
+    return getattr(settings, "NORDIGEN_COMPACT_PAYLOADS", False)
+
+
+def archive_responses_enabled():
+    return getattr(settings, "NORDIGEN_ARCHIVE_RESPONSES", False)
+
+
+def get_algorithm():
+    algorithm = getattr(settings, "NORDIGEN_PAYLOAD_COMPRESSION", ZLIB)
+    if algorithm not in PREFIXES:
+        raise ImproperlyConfigured(
+            f"NORDIGEN_PAYLOAD_COMPRESSION must be one of {list(PREFIXES)}"
+        )
+    return algorithm
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImproperlyConfigured(
+            "zstd payload compression requires the zstandard package"
+        ) from error
+    return zstandard
+
+
+def compress(data, algorithm, dictionary=None):
+    if algorithm == ZSTD:
+        zstandard = import_zstandard()
+        dict_data = dictionary and zstandard.ZstdCompressionDict(dictionary)
+        body = zstandard.ZstdCompressor(dict_data=dict_data).compress(data)
+
+    else:
+        compressor = zlib.compressobj(9, zdict=dictionary or b"")
+        body = compressor.compress(data) + compressor.flush()
+
+    return PREFIXES[algorithm] + body
+
+
+def decompress(blob, dictionary=None):
+    blob = bytes(blob)
+    prefix, body = blob[:1], blob[1:]
+    if prefix == PREFIXES[ZSTD]:
+        zstandard = import_zstandard()
+        dict_data = dictionary and zstandard.ZstdCompressionDict(dictionary)
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(body)
+
+    decompressor = zlib.decompressobj(zdict=dictionary or b"")
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+def train_dictionary(algorithm, samples, size):
+    if algorithm == ZSTD:
+        zstandard = import_zstandard()
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    # zlib preset dictionaries are plain content; zlib favours the end of it
+    size = min(size, ZLIB_MAX_DICTIONARY_SIZE)
+    return b"".join(samples)[-size:]
+
+
+def encode_json(data):
+    return json.dumps(data, separators=(",", ":")).encode("utf8")
+
+
+def parse_amount(api_data):
+    money = api_data.get("transactionAmount")
+    if not isinstance(money, dict) or set(money) != {"amount", "currency"}:
+        return None, ""
+
+    try:
+        amount = Decimal(money["amount"])
+    except (InvalidOperation, TypeError):
+        return None, ""
+
+    if f"{amount:.2f}" != money["amount"] or len(money["currency"]) > 3:
+        return None, ""
+
+    return amount, money["currency"]
+
+
+def strip_payload(api_data, nordigen_id, booking_date, amount, currency):
+    columns = {
+        "i": nordigen_id,
+        "b": booking_date and booking_date.isoformat(),
+        "a": amount is not None and {"amount": f"{amount:.2f}", "currency": currency},
+    }
+    remainder = dict(api_data)
+    stripped = ""
+    for flag, key in STRIPPED.items():
+        if columns[flag] and remainder.get(key) == columns[flag]:
+            del remainder[key]
+            stripped += flag
+
+    remainder[STRIPPED_KEY] = stripped
+    return remainder
+
+
+def restore_payload(remainder, nordigen_id, booking_date, amount, currency):
+    api_data = dict(remainder)
+    stripped = api_data.pop(STRIPPED_KEY, "")
+    if "i" in stripped:
+        api_data["internalTransactionId"] = nordigen_id
+    if "b" in stripped:
+        api_data["bookingDate"] = booking_date.isoformat()
+    if "a" in stripped:
+        api_data["transactionAmount"] = {
+            "amount": f"{amount:.2f}",
+            "currency": currency,
+        }
+    return api_data
+
+
+class PayloadCompressor:
+    def __init__(self, algorithm, dictionary=None):
+        self.algorithm = algorithm
+        self.dictionary = dictionary
+
+    def compress(self, remainder):
+        dictionary = self.dictionary and bytes(self.dictionary.data)
+        return compress(encode_json(remainder), self.algorithm, dictionary)
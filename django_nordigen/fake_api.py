@@ -0,0 +1,361 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections.abc import Iterator
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import NAMESPACE_URL, uuid4, uuid5
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/v2"
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def fake_uuid(*parts):
+    return str(uuid5(NAMESPACE_URL, "/".join(str(part) for part in parts)))
+
+
+def iter_json(value):
+    # Iterators are encoded item by item, so large responses are never
+    # held whole and don't weigh on memory measurements of the client
+    if isinstance(value, dict):
+        yield "{"
+        for n, (key, item) in enumerate(value.items()):
+            yield f"{',' if n else ''}{json.dumps(key)}:"
+            yield from iter_json(item)
+        yield "}"
+    elif isinstance(value, Iterator):
+        yield "["
+        for n, item in enumerate(value):
+            yield f"{',' if n else ''}{json.dumps(item)}"
+        yield "]"
+    else:
+        yield json.dumps(value)
+
+
+class FakeNordigen:
+    def __init__(
+        self,
+        institutions=10,
+        requisitions=1,
+        accounts_per_requisition=2,
+        transactions_per_account=100,
+        history_days=365,
+        expired_requisitions=0,
+        latency=0,
+        error_rate=0,
+        error_status=500,
+        throttle_rate=0,
+        seed=0,
+    ):
+        self.institutions = institutions
+        self.requisitions = requisitions
+        self.accounts_per_requisition = accounts_per_requisition
+        self.transactions_per_account = transactions_per_account
+        self.history_days = history_days
+        self.expired_requisitions = expired_requisitions
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.error_count = 0
+        self.lock = threading.Lock()
+        self.accounts = {
+            fake_uuid("account", r, a): r
+            for r in range(requisitions)
+            for a in range(accounts_per_requisition)
+        }
+
+    def institution_id(self, n):
+        return f"FAKEBANK_{n:05d}"
+
+    def requisition_id(self, n):
+        return fake_uuid("requisition", n)
+
+    def requisition_ids(self):
+        return [self.requisition_id(n) for n in range(self.requisitions)]
+
+    def institution(self, nordigen_id):
+        return {
+            "id": nordigen_id,
+            "name": nordigen_id.replace("_", " ").title(),
+            "bic": nordigen_id[:8],
+            "transaction_total_days": str(self.history_days),
+            "countries": ["XX"],
+            "logo": "",
+        }
+
+    def requisition(self, nordigen_id):
+        n = self.requisition_ids().index(nordigen_id)
+        return {
+            "id": nordigen_id,
+            "created": "2020-01-01T00:00:00Z",
+            "redirect": "http://localhost/",
+            "status": "LN",
+            "institution_id": self.institution_id(n % self.institutions),
+            "agreement": fake_uuid("agreement", n),
+            "reference": fake_uuid("reference", n),
+            "accounts": [
+                fake_uuid("account", n, a) for a in range(self.accounts_per_requisition)
+            ],
+            "link": f"http://localhost/fake/{nordigen_id}",
+        }
+
+    def agreement(self, nordigen_id):
+        n = [fake_uuid("agreement", n) for n in range(self.requisitions)].index(
+            nordigen_id
+        )
+        access_valid_for_days = 90
+        accepted = date.today() - timedelta(days=10)
+        if n < self.expired_requisitions:
+            accepted -= timedelta(days=access_valid_for_days)
+        return {
+            "id": nordigen_id,
+            "created": f"{accepted}T00:00:00Z",
+            "institution_id": self.institution_id(n % self.institutions),
+            "max_historical_days": self.history_days,
+            "access_valid_for_days": access_valid_for_days,
+            "access_scope": ["balances", "details", "transactions"],
+            "accepted": f"{accepted}T00:00:00Z",
+        }
+
+    def account(self, nordigen_id):
+        return {
+            "id": nordigen_id,
+            "created": "2020-01-01T00:00:00Z",
+            "last_accessed": None,
+            "iban": self.iban(nordigen_id),
+            "institution_id": self.institution_id(
+                self.accounts[nordigen_id] % self.institutions
+            ),
+            "status": "READY",
+        }
+
+    def iban(self, nordigen_id):
+        return "XX00FAKE" + nordigen_id.replace("-", "")[:16].upper()
+
+    def details(self, nordigen_id):
+        return {
+            "account": {
+                "resourceId": nordigen_id,
+                "iban": self.iban(nordigen_id),
+                "currency": "EUR",
+                "ownerName": "Fake Owner",
+            },
+        }
+
+    def balances(self, nordigen_id):
+        amount = {"amount": "1000.00", "currency": "EUR"}
+        return {
+            "balances": [
+                {"balanceAmount": amount, "balanceType": balance_type}
+                for balance_type in ["expected", "closingBooked", "interimAvailable"]
+            ],
+        }
+
+    def transactions(self, nordigen_id, date_from, date_to):
+        today = date.today()
+        start = today - timedelta(days=self.history_days)
+        date_from = max(date_from, start)
+        date_to = min(date_to, today)
+        total = self.transactions_per_account
+        days = self.history_days
+
+        def booked():
+            day = date_from
+            while day <= date_to:
+                offset = (day - start).days
+                for n in range(offset * total // days, (offset + 1) * total // days):
+                    yield self.transaction(nordigen_id, n, day)
+                day += timedelta(days=1)
+
+        return {"transactions": {"booked": booked(), "pending": []}}
+
+    def transaction(self, nordigen_id, n, day):
+        return {
+            "transactionId": f"{nordigen_id[:8]}-{n}",
+            "internalTransactionId": fake_uuid(nordigen_id, n).replace("-", ""),
+            "bookingDate": day.isoformat(),
+            "valueDate": day.isoformat(),
+            "transactionAmount": {
+                "amount": f"{(n % 997) - 498}.{n % 100:02d}",
+                "currency": "EUR",
+            },
+            "creditorName": f"Merchant {n % 50}",
+            "remittanceInformationUnstructured": f"Payment {n}",
+            "bankTransactionCode": "PMNT",
+        }
+
+    def handle(self, method, path, query):
+        routes = [
+            ("POST", r"token/new/", lambda: self.token(refresh=True)),
+            ("POST", r"token/refresh/", lambda: self.token(refresh=False)),
+            ("GET", r"institutions/", self.list_institutions),
+            ("GET", r"institutions/(?P<nordigen_id>[^/]+)/", self.institution),
+            ("POST", r"agreements/enduser/", lambda: {"id": str(uuid4())}),
+            ("GET", r"agreements/enduser/(?P<nordigen_id>[^/]+)/?", self.agreement),
+            ("POST", r"requisitions/", self.create_requisition),
+            ("GET", r"requisitions/(?P<nordigen_id>[^/]+)/", self.requisition),
+            ("GET", r"accounts/(?P<nordigen_id>[^/]+)/", self.account),
+            ("GET", r"accounts/(?P<nordigen_id>[^/]+)/details/", self.details),
+            ("GET", r"accounts/(?P<nordigen_id>[^/]+)/balances/", self.balances),
+            (
+                "GET",
+                r"accounts/(?P<nordigen_id>[^/]+)/transactions/",
+                lambda nordigen_id: self.transactions(
+                    nordigen_id,
+                    date.fromisoformat(query["date_from"]),
+                    date.fromisoformat(query["date_to"]),
+                ),
+            ),
+        ]
+        for route_method, pattern, view in routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                try:
+                    return 200, view(**match.groupdict())
+                except (KeyError, ValueError):
+                    return 404, {"summary": "Not found", "status_code": 404}
+
+        return 404, {"summary": "Not found", "status_code": 404}
+
+    def token(self, refresh):
+        data = {"access": uuid4().hex, "access_expires": 86400}
+        if refresh:
+            data.update(refresh=uuid4().hex, refresh_expires=2592000)
+        return data
+
+    def list_institutions(self):
+        return [
+            self.institution(self.institution_id(n)) for n in range(self.institutions)
+        ]
+
+    def create_requisition(self):
+        return self.requisition(self.requisition_id(0))
+
+    def respond(self, method, path, query):
+        with self.lock:
+            self.request_count += 1
+            roll = self.random.random()
+            fail = roll < self.error_rate
+            throttle = not fail and roll < self.error_rate + self.throttle_rate
+            if fail or throttle:
+                self.error_count += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if fail:
+            return self.error_status, {
+                "summary": "Injected failure",
+                "status_code": self.error_status,
+            }
+
+        if throttle:
+            return 429, {
+                "summary": "Rate limit exceeded",
+                "status_code": 429,
+            }
+
+        return self.handle(method, path, query)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: value[0] for key, value in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        if url.path.startswith(API_PREFIX + "/"):
+            path = url.path.removeprefix(API_PREFIX + "/")
+            status, data = self.server.fake.respond(method, path, query)
+        else:
+            status, data = 404, {"summary": "Not found", "status_code": 404}
+
+        # HTTP/1.0, so the end of the body is marked by closing the connection
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        chunk = []
+        size = 0
+        for piece in iter_json(data):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= WRITE_CHUNK_SIZE:
+                self.wfile.write("".join(chunk).encode("utf8"))
+                chunk = []
+                size = 0
+        self.wfile.write("".join(chunk).encode("utf8"))
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class FakeNordigenServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fake, host="127.0.0.1", port=0):
+        super().__init__((host, port), RequestHandler)
+        self.fake = fake
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+def add_fake_arguments(parser):
+    parser.add_argument("--institutions", default=10, type=int)
+    parser.add_argument("--requisitions", default=1, type=int)
+    parser.add_argument("--accounts-per-requisition", default=2, type=int)
+    parser.add_argument("--transactions-per-account", default=100, type=int)
+    parser.add_argument("--history-days", default=365, type=int)
+    parser.add_argument("--expired-requisitions", default=0, type=int)
+    parser.add_argument("--latency", default=0, type=float, help="seconds")
+    parser.add_argument("--error-rate", default=0, type=float)
+    parser.add_argument("--error-status", default=500, type=int)
+    parser.add_argument(
+        "--throttle-rate", default=0, type=float, help="fraction answered with 429"
+    )
+    parser.add_argument("--seed", default=0, type=int)
+
+
+def fake_from_options(options):
+    return FakeNordigen(
+        institutions=options["institutions"],
+        requisitions=options["requisitions"],
+        accounts_per_requisition=options["accounts_per_requisition"],
+        transactions_per_account=options["transactions_per_account"],
+        history_days=options["history_days"],
+        expired_requisitions=options["expired_requisitions"],
+        latency=options["latency"],
+        error_rate=options["error_rate"],
+        error_status=options["error_status"],
+        throttle_rate=options["throttle_rate"],
+        seed=options["seed"],
+    )
@@ -0,0 +1,56 @@
+import hashlib
+import re
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+
+def normalize(value):
+    return re.sub(r"\s+", " ", str(value or "")).strip().casefold()
+
+
+def digest(*parts):
+    text = "\x1f".join(normalize(part) for part in parts)
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).hexdigest()
+
+
+def transaction_fingerprint(api_data):
+    money = api_data.get("transactionAmount") or {}
+    amount = money.get("amount")
+    try:
+        amount = f"{Decimal(amount):.2f}"
+    except (InvalidOperation, TypeError):
+        pass
+
+    counterparty = api_data.get("creditorName") or api_data.get("debtorName")
+    counterparty_account = (
+        api_data.get("creditorAccount") or api_data.get("debtorAccount") or {}
+    )
+    remittance = api_data.get("remittanceInformationUnstructured") or " ".join(
+        api_data.get("remittanceInformationUnstructuredArray", [])
+    )
+    return digest(
+        amount,
+        money.get("currency"),
+        api_data.get("bookingDate"),
+        api_data.get("valueDate"),
+        counterparty,
+        counterparty_account.get("iban"),
+        remittance,
+    )
+
+
+def fingerprint_id(fingerprint, occurrence):
+    # Stands in for a missing internalTransactionId. Identical transactions in
+    # one response are told apart by the order they come in.
+    return digest(fingerprint, occurrence)
+
+
+def with_transaction_ids(booked):
+    occurrences = Counter()
+    for api_data in booked:
+        nordigen_id = api_data.get("internalTransactionId")
+        if not nordigen_id:
+            fingerprint = transaction_fingerprint(api_data)
+            nordigen_id = fingerprint_id(fingerprint, occurrences[fingerprint])
+            occurrences[fingerprint] += 1
+        yield nordigen_id, api_data
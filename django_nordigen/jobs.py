@@ -0,0 +1,60 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_WORKERS = 2
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                getattr(settings, "NORDIGEN_JOB_WORKERS", DEFAULT_JOB_WORKERS),
+                thread_name_prefix="nordigen-job",
+            )
+    return executor
+
+
+def start_job(name, func, items):
+    # Jobs run in threads of the current process; progress is kept in the
+    # database so any web worker can show it
+    items = list(items)
+    job = Job.objects.create(name=name, total=len(items))
+    transaction.on_commit(lambda: get_executor().submit(run_job, job, func, items))
+    return job
+
+
+def run_job(job, func, items):
+    try:
+        for item in items:
+            try:
+                func(item)
+            except Exception as error:
+                logger.exception("Error in job %r on %r", job, item)
+                Job.objects.filter(pk=job.pk).update(
+                    failed=F("failed") + 1, error=repr(error)
+                )
+            finally:
+                Job.objects.filter(pk=job.pk).update(
+                    done=F("done") + 1, updated_at=timezone.now()
+                )
+        job.finish()
+
+    except Exception:
+        logger.exception("Error finishing job %r", job)
+
+    finally:
+        close_old_connections()
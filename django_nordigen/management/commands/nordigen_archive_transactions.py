@@ -0,0 +1,49 @@
+from datetime import timedelta
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from django_nordigen.aggregates import transactions_removed
+from django_nordigen.models import ArchivedTransaction, Transaction
+
+
+class Command(BaseCommand):
+    help = "Move transactions booked before the retention period to the archive table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", default=730, type=int)
+        parser.add_argument("--batch-size", default=5000, type=int)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now().date() - timedelta(days=options["days"])
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(field.column) for field in Transaction._meta.concrete_fields
+        )
+        queryset = Transaction.objects.filter(booking_date__lt=cutoff).order_by("pk")
+        count = 0
+        while True:
+            with transaction.atomic():
+                rows = queryset.values_list("pk", "account_id")[: options["batch_size"]]
+                ids = [pk for pk, _ in rows]
+                if not ids:
+                    break
+                account_ids = {account_id for _, account_id in rows}
+
+                # Copy rows in SQL so payloads are never decoded or re-encoded
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {quote(ArchivedTransaction._meta.db_table)} "
+                        f"({columns}) SELECT {columns} "
+                        f"FROM {quote(Transaction._meta.db_table)} "
+                        f"WHERE {quote(Transaction._meta.pk.column)} "
+                        f"IN ({', '.join(['%s'] * len(ids))})",
+                        ids,
+                    )
+                Transaction.objects.filter(pk__in=ids).delete()
+                transaction.on_commit(partial(transactions_removed, account_ids))
+
+            count += len(ids)
+            print(f"Archived {count} transactions booked before {cutoff}")
@@ -0,0 +1,70 @@
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from django_nordigen.backfill import BACKFILLS, process_pool, run_range
+from django_nordigen.models import BackfillProgress
+
+
+class Command(BaseCommand):
+    help = "Run a data backfill in primary key ranges over a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", nargs="?")
+        parser.add_argument("--chunk-size", default=5000, type=int)
+        parser.add_argument("--workers", default=4, type=int)
+        parser.add_argument(
+            "--sleep",
+            default=0,
+            type=float,
+            help="seconds each worker pauses after a chunk, to limit load",
+        )
+        parser.add_argument("--restart", action="store_true")
+
+    def handle(self, *args, **options):
+        name = options["name"]
+        if name is None:
+            progress = {p.name: p for p in BackfillProgress.objects.all()}
+            for name in BACKFILLS:
+                state = progress.get(name)
+                if state is None:
+                    print(f"{name}: not started")
+                elif state.finished_at:
+                    print(f"{name}: finished at {state.finished_at}")
+                else:
+                    print(f"{name}: at {state.last_pk}/{state.max_pk}")
+            return
+
+        if name not in BACKFILLS:
+            raise CommandError(f"Unknown backfill {name!r}")
+
+        backfill = BACKFILLS[name]()
+        progress, _ = BackfillProgress.objects.get_or_create(name=name)
+        if options["restart"] or progress.max_pk is None:
+            # Rows created later are written in their final form already
+            max_pk = backfill.model.objects.aggregate(max_pk=Max("pk"))["max_pk"]
+            progress.last_pk = 0
+            progress.max_pk = max_pk or 0
+            progress.changed = 0
+            progress.finished_at = None
+            progress.save()
+
+        size = options["chunk_size"]
+        starts = range(progress.last_pk, progress.max_pk + 1, size)
+
+        work = partial(run_range, name, sleep=options["sleep"])
+        with process_pool(options["workers"]) as executor:
+            ends = [start + size for start in starts]
+            for end, changed in zip(ends, executor.map(work, starts, ends)):
+                # Results come back in order, so last_pk only moves past
+                # ranges that are done
+                progress.last_pk = end
+                progress.changed += changed
+                progress.save(update_fields=["last_pk", "changed", "updated_at"])
+                print(f"{name}: {min(end, progress.max_pk)}/{progress.max_pk}")
+
+        progress.finished_at = timezone.now()
+        progress.save(update_fields=["finished_at", "updated_at"])
+        print(f"{name}: finished, {progress.changed} rows changed")
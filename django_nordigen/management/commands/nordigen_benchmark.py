@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from django_nordigen.benchmark import (
+    format_results,
+    format_startup,
+    measure_startup,
+    run_benchmark,
+)
+from django_nordigen.fake_api import add_fake_arguments, fake_from_options
+
+
+class Command(BaseCommand):
+    help = "Benchmark sync and admin against a fake Nordigen API in a test database"
+
+    def add_arguments(self, parser):
+        add_fake_arguments(parser)
+        parser.add_argument("--no-admin", action="store_true")
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="sync with NORDIGEN_STREAM_TRANSACTIONS enabled",
+        )
+        parser.add_argument(
+            "--startup",
+            action="store_true",
+            help="measure process startup and import time instead",
+        )
+
+    def handle(self, *args, **options):
+        if options["startup"]:
+            print(format_startup(measure_startup()))
+            return
+
+        fake = fake_from_options(options)
+        old_name = connection.settings_dict["NAME"]
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmark(
+                fake, admin=not options["no_admin"], stream=options["stream"]
+            )
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        print(format_results(results))
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_nordigen.compression import (
+    compact_payloads_enabled,
+    encode_json,
+    get_algorithm,
+    strip_payload,
+    train_dictionary,
+)
+from django_nordigen.models import (
+    Account,
+    ArchivedTransaction,
+    PayloadDictionary,
+    Transaction,
+)
+
+UPDATE_FIELDS = [
+    "api_data",
+    "api_data_compressed",
+    "payload_dictionary",
+    "transaction_amount",
+    "transaction_currency",
+]
+
+
+class Command(BaseCommand):
+    help = "Convert stored transaction payloads to or from compact storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", default=1000, type=int)
+        parser.add_argument("--expand", action="store_true")
+        parser.add_argument("--train", action="store_true")
+        parser.add_argument("--dictionary-size", default=16 * 1024, type=int)
+        parser.add_argument("--samples", default=2000, type=int)
+
+    def handle(self, *args, **options):
+        if options["train"]:
+            self.train(options["dictionary_size"], options["samples"])
+
+        if not options["expand"] and not compact_payloads_enabled():
+            print(
+                "Warning: NORDIGEN_COMPACT_PAYLOADS is off, "
+                "new transactions will be stored expanded"
+            )
+
+        institutions = dict(Account.objects.values_list("pk", "institution_id"))
+        compressors = {}
+        for model in [Transaction, ArchivedTransaction]:
+            self.convert(model, institutions, compressors, options)
+
+    def convert(self, model, institutions, compressors, options):
+        queryset = model.objects.with_payload().order_by("pk")
+        name = model._meta.verbose_name_plural
+        last_pk = 0
+        count = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[: options["batch_size"]])
+            if not batch:
+                break
+
+            for tr in batch:
+                compressor = None
+                if not options["expand"]:
+                    institution_id = institutions[tr.account_id]
+                    if institution_id not in compressors:
+                        compressors[institution_id] = PayloadDictionary.get_compressor(
+                            institution_id
+                        )
+                    compressor = compressors[institution_id]
+                tr.set_payload(tr.data, compressor)
+
+            with transaction.atomic():
+                model.objects.bulk_update(batch, UPDATE_FIELDS)
+
+            last_pk = batch[-1].pk
+            count += len(batch)
+            print(f"Converted {count} {name} (up to pk {last_pk})")
+
+    def train(self, size, sample_count):
+        algorithm = get_algorithm()
+        for institution_id in set(
+            Account.objects.values_list("institution_id", flat=True)
+        ):
+            sample = Transaction.objects.with_payload().filter(
+                account__institution_id=institution_id
+            )[:sample_count]
+            samples = [
+                encode_json(strip_payload(tr.data, *tr.payload_columns))
+                for tr in sample
+            ]
+            if not samples:
+                continue
+
+            try:
+                data = train_dictionary(algorithm, samples, size)
+            except Exception as error:
+                print(f"Could not train dictionary for {institution_id}: {error}")
+                continue
+
+            PayloadDictionary.objects.create(
+                institution_id=institution_id, algorithm=algorithm, data=data
+            )
+            print(f"Trained {algorithm} dictionary for {institution_id}")
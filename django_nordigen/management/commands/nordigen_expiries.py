@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from django_nordigen.models import Requisition
+
+
+class Command(BaseCommand):
+    help = "List active requisitions whose access expires soon"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", default=14, type=int)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        queryset = (
+            Requisition.objects.filter(active=True)
+            .filter(
+                Q(expires_at__lte=now + timedelta(days=options["days"]))
+                | Q(expires_at__isnull=True)
+            )
+            .select_related("institution")
+            .order_by("expires_at")
+        )
+        for requisition in queryset:
+            if requisition.expires_at is None:
+                expires = "unknown"
+            else:
+                expires = f"{requisition.expires_at:%Y-%m-%d} "
+                expires += f"({(requisition.expires_at - now).days} days)"
+            print(requisition.nordigen_id, requisition.institution, expires)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from django_nordigen.fake_api import (
+    FakeNordigenServer,
+    add_fake_arguments,
+    fake_from_options,
+)
+
+
+class Command(BaseCommand):
+    help = "Serve a fake Nordigen API with synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", default=8001, type=int)
+        add_fake_arguments(parser)
+
+    def handle(self, *args, **options):
+        fake = fake_from_options(options)
+        server = FakeNordigenServer(fake, options["host"], options["port"])
+        print(f"Set NORDIGEN_BASE_URL={server.base_url}")
+        print("Requisitions:", *fake.requisition_ids(), sep="\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -8,10 +8,12 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("country")
+        parser.add_argument("--refresh", action="store_true")
 
     def handle(self, *args, **options):
         country = options["country"]
-        for institution in get_api().get_institutions(country=country):
+        institutions = get_api().get_institutions(country, options["refresh"])
+        for institution in institutions:
             print(
                 institution["id"],
                 institution["transaction_total_days"],
@@ -0,0 +1,46 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from django_nordigen.api import SYNC_REQUEST_INTERVAL, process_sync_requests
+from django_nordigen.management.commands.nordigen_sync import priority
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Sync accounts queued through the sync endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", default=100, type=int)
+        parser.add_argument(
+            "--priority",
+            action="append",
+            type=priority,
+            help="only take requests of this priority, can be repeated",
+        )
+        parser.add_argument(
+            "--loop",
+            nargs="?",
+            const=SYNC_REQUEST_INTERVAL.total_seconds(),
+            type=int,
+            help="keep running, polling the queue every LOOP seconds",
+        )
+
+    def handle(self, *args, **options):
+        if not options["loop"]:
+            count = process_sync_requests(options["limit"], options["priority"])
+            print(f"Synced {count} accounts")
+            return
+
+        while True:
+            try:
+                if process_sync_requests(options["limit"], options["priority"]):
+                    continue
+            except Exception:
+                logger.exception("Error processing sync requests")
+            finally:
+                close_old_connections()
+            time.sleep(options["loop"])
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from django_nordigen.models import SyncRun
+
+
+class Command(BaseCommand):
+    help = "Delete sync run history older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", default=30, type=int)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        count, _ = SyncRun.objects.filter(started_at__lt=cutoff).delete()
+        print(f"Deleted {count} records")
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from django_nordigen.aggregates import months_changed
+from django_nordigen.models import Account, MonthlyRollup
+
+
+def rebuild_chunk(account_ids):
+    try:
+        for account_id in account_ids:
+            with transaction.atomic():
+                # Same lock as ingestion, so rollups can't miss a concurrent sync
+                account = Account.objects.select_for_update().get(pk=account_id)
+                months = MonthlyRollup.rebuild(account)
+            months_changed(account_id, months)
+        return len(account_ids)
+
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Recompute monthly rollups from stored transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", action="append", type=int)
+        parser.add_argument("--chunk-size", default=100, type=int)
+        parser.add_argument("--workers", default=4, type=int)
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.order_by("pk")
+        if options["account"]:
+            accounts = accounts.filter(pk__in=options["account"])
+        account_ids = list(accounts.values_list("pk", flat=True))
+        size = options["chunk_size"]
+        chunks = [account_ids[i:][:size] for i in range(0, len(account_ids), size)]
+
+        count = 0
+        with ThreadPoolExecutor(options["workers"]) as executor:
+            for done in executor.map(rebuild_chunk, chunks):
+                count += done
+                print(f"Rebuilt rollups for {count}/{len(account_ids)} accounts")
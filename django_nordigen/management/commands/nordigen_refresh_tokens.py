@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from django_nordigen.api import (
+    TOKEN_REFRESH_INTERVAL,
+    TOKEN_REFRESH_MARGIN,
+    TokenRefresher,
+    refresh_all_tokens,
+)
+
+
+class Command(BaseCommand):
+    help = "Renew Nordigen tokens that are about to expire"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--margin", default=TOKEN_REFRESH_MARGIN.total_seconds(), type=int
+        )
+        parser.add_argument(
+            "--loop",
+            nargs="?",
+            const=TOKEN_REFRESH_INTERVAL.total_seconds(),
+            type=int,
+            help="keep running, renewing every LOOP seconds",
+        )
+
+    def handle(self, *args, **options):
+        margin = timedelta(seconds=options["margin"])
+        if options["loop"]:
+            refresher = TokenRefresher(timedelta(seconds=options["loop"]), margin)
+            refresher.run()
+
+        else:
+            refresh_all_tokens(margin)
@@ -0,0 +1,103 @@
+from datetime import date
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from django_nordigen.aggregates import months_changed, transactions_removed
+from django_nordigen.backfill import process_pool
+from django_nordigen.compression import compact_payloads_enabled
+from django_nordigen.fingerprint import with_transaction_ids
+from django_nordigen.models import (
+    Account,
+    ArchivedTransaction,
+    MonthlyRollup,
+    PayloadDictionary,
+    Transaction,
+    TransactionResponse,
+)
+
+
+def rebuild_transactions(account):
+    archived = set(
+        account.archivedtransaction_set.values_list("nordigen_id", flat=True)
+    )
+    fingerprints = set()
+    for model in [Transaction, ArchivedTransaction]:
+        fingerprints.update(
+            model.objects.filter(
+                account__in=account.siblings().filter(pk__lt=account.pk)
+            ).values_list("fingerprint", flat=True)
+        )
+    compressor = None
+    if compact_payloads_enabled():
+        compressor = PayloadDictionary.get_compressor(account.institution_id)
+
+    # Replays ingestion: the first response with a transaction wins
+    rows = {}
+    for response in account.transactionresponse_set.iterator():
+        for nordigen_id, api_data in with_transaction_ids(
+            response.response["transactions"]["booked"]
+        ):
+            if nordigen_id in rows or nordigen_id in archived:
+                continue
+            rows[nordigen_id] = Transaction.from_api(
+                account, nordigen_id, api_data, compressor, fingerprints
+            )
+    return rows
+
+
+def reprocess_account(account_id, batch_size):
+    try:
+        account = Account.objects.get(pk=account_id)
+        rows = rebuild_transactions(account)
+        ids = list(rows)
+        with transaction.atomic():
+            Account.objects.select_for_update().filter(pk=account.pk).exists()
+            for start in range(0, len(ids), batch_size):
+                account.transaction_set.filter(
+                    nordigen_id__in=ids[start:][:batch_size]
+                ).delete()
+            Transaction.objects.bulk_create(rows.values(), batch_size=batch_size)
+            months = MonthlyRollup.rebuild(account)
+            siblings = account.flag_duplicates(
+                {tr.fingerprint for tr in rows.values() if not tr.duplicate},
+                date.min,
+            )
+
+        transactions_removed([account.pk])
+        months_changed(account.pk, months)
+        for sibling_id, sibling_months in siblings.items():
+            months_changed(sibling_id, sibling_months)
+        return len(rows)
+
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Rebuild transactions from archived API responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", action="append", type=int)
+        parser.add_argument("--batch-size", default=1000, type=int)
+        parser.add_argument("--workers", default=4, type=int)
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.filter(
+            pk__in=TransactionResponse.objects.values("account")
+        ).order_by("pk")
+        if options["account"]:
+            accounts = accounts.filter(pk__in=options["account"])
+        account_ids = list(accounts.values_list("pk", flat=True))
+
+        work = partial(reprocess_account, batch_size=options["batch_size"])
+        count = 0
+        with process_pool(options["workers"]) as executor:
+            for account_id, created in zip(
+                account_ids, executor.map(work, account_ids)
+            ):
+                count += created
+                print(f"Account {account_id}: {created} transactions")
+
+        print(f"Rebuilt {count} transactions")
@@ -1,6 +1,8 @@
+from uuid import UUID
+
 from django.core.management.base import BaseCommand
 
-from django_nordigen.api import get_api
+from django_nordigen.api import get_api, get_integrations
 
 
 class Command(BaseCommand):
@@ -10,6 +12,7 @@ class Command(BaseCommand):
         parser.add_argument("institution")
         parser.add_argument("--max-historical-days", default=30)
         parser.add_argument("--access-valid-for-days", default=180)
+        parser.add_argument("--integration", type=UUID)
 
     def handle(
         self,
@@ -17,9 +20,12 @@ class Command(BaseCommand):
         institution,
         max_historical_days,
         access_valid_for_days,
+        integration,
         **options,
     ):
-        link = get_api().create_requisition(
+        if integration:
+            [integration] = get_integrations([integration])
+        link = get_api(integration).create_requisition(
             institution, max_historical_days, access_valid_for_days
         )
         print(link)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from django_nordigen.fake_api import add_fake_arguments, fake_from_options
+from django_nordigen.soak import run_soak
+
+
+class Command(BaseCommand):
+    help = "Run concurrent syncs against a fake Nordigen API in a test database"
+
+    def add_arguments(self, parser):
+        add_fake_arguments(parser)
+        parser.add_argument("--duration", default=60, type=float, help="seconds")
+        parser.add_argument("--threads", default=8, type=int)
+        parser.add_argument("--report-interval", default=10, type=float)
+        parser.add_argument(
+            "--token-expiry",
+            type=float,
+            help="expire access tokens every this many seconds",
+        )
+
+    def handle(self, *args, **options):
+        fake = fake_from_options(options)
+        old_name = connection.settings_dict["NAME"]
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            stats, problems = run_soak(
+                fake,
+                options["duration"],
+                threads=options["threads"],
+                report_interval=options["report_interval"],
+                token_expiry=options["token_expiry"],
+                report=self.stdout.write,
+            )
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for problem in problems:
+            self.stdout.write(f"FAILED: {problem}")
+        if problems:
+            raise CommandError(f"{len(problems)} consistency problems found")
+        self.stdout.write("No consistency problems found")
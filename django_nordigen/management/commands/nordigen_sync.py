@@ -1,10 +1,45 @@
-from argparse import BooleanOptionalAction
+from argparse import ArgumentTypeError, BooleanOptionalAction
 from datetime import timedelta
 from uuid import UUID
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from django_nordigen.api import ALL_REQUISITIONS, get_api
+from django_nordigen.api import (
+    ALL_REQUISITIONS,
+    Api,
+    get_api,
+    get_integrations,
+    get_request_seconds,
+    get_requests_today,
+)
+from django_nordigen.models import SyncPriority
+
+
+def priority(value):
+    try:
+        return SyncPriority[value.upper()]
+    except KeyError:
+        raise ArgumentTypeError(f"Invalid priority {value!r}")
+
+
+def background_priority(value):
+    # Interactive lanes would skip deferring to queued work and the reserve
+    if value.lower() not in ["scheduled", "backfill"]:
+        raise ArgumentTypeError(
+            f"Invalid priority {value!r}, expected scheduled or backfill"
+        )
+    return priority(value)
+
+
+def shard(value):
+    try:
+        index, count = [int(n) for n in value.split("/")]
+    except ValueError:
+        raise ArgumentTypeError(f"Invalid shard {value!r}, expected i/n")
+    if not 0 <= index < count:
+        raise ArgumentTypeError(f"Invalid shard {value!r}, expected 0 <= i < n")
+    return index, count
 
 
 class Command(BaseCommand):
@@ -17,9 +52,78 @@ class Command(BaseCommand):
         parser.add_argument(
             "--transactions", action=BooleanOptionalAction, default=True
         )
+        parser.add_argument("--integration", action="append", type=UUID)
+        parser.add_argument("--shard", type=shard)
+        parser.add_argument(
+            "--priority",
+            type=background_priority,
+            help="scheduled or backfill, default backfill with --history",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="estimate the API requests a sync would make, without syncing",
+        )
 
     def handle(self, *args, **options):
         requisitions = [UUID(r) for r in options["requisition"]] or ALL_REQUISITIONS
         history = options["history"]
         max_age = timedelta(seconds=options["max_age"])
-        get_api().sync(requisitions, max_age, history, options["transactions"])
+        integrations = get_integrations(options["integration"], options["shard"])
+        if options["plan"]:
+            self.plan(integrations, requisitions, max_age, history, options)
+            return
+
+        for integration in integrations:
+            get_api(integration).sync(
+                requisitions,
+                max_age,
+                history,
+                options["transactions"],
+                options["priority"],
+            )
+
+    def plan(self, integrations, requisitions, max_age, history, options):
+        limit = getattr(settings, "NORDIGEN_DAILY_REQUEST_LIMIT", None)
+        total = 0
+        unknown = 0
+        for integration in integrations:
+            # No client, so planning can't renew tokens or call the API
+            rows = Api(integration, None).plan(
+                requisitions, max_age, history, options["transactions"]
+            )
+            requests = sum(row["requests"] for row in rows)
+            total += requests
+            print(f"Integration {integration.nordigen_id}")
+            for row in rows:
+                if row["account"] is None:
+                    line = f"  requisition {row['requisition']}: {row['requests']}"
+                    if row["unknown"]:
+                        line += " plus its accounts, not fetched yet"
+                        unknown += 1
+                    print(line)
+                else:
+                    print(
+                        f"    account {row['account']}: {row['requests']} "
+                        f"({row['windows']} transaction windows)"
+                    )
+            print(f"  {requests} requests")
+
+            if limit is not None:
+                used = get_requests_today(integration)
+                if used + requests > limit:
+                    print(
+                        f"  Warning: {used} requests made today, "
+                        f"the daily limit of {limit} would be exceeded"
+                    )
+
+        if unknown:
+            print(
+                f"Total: at least {total} requests, "
+                f"{unknown} requisitions have accounts not fetched yet"
+            )
+        else:
+            print(f"Total: {total} requests")
+        seconds = get_request_seconds()
+        if seconds is not None:
+            print(f"Estimated duration: {timedelta(seconds=round(total * seconds))}")
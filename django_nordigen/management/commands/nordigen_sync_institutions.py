@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from django_nordigen.api import get_api
+
+
+class Command(BaseCommand):
+    help = "Download the Nordigen institution catalog for one or more countries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("country", nargs="+")
+
+    def handle(self, *args, **options):
+        api = get_api()
+        for country in options["country"]:
+            catalog = api.sync_institutions(country)
+            print(f"{country}: {len(catalog)} institutions")
@@ -0,0 +1,113 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0013_requisition_active"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("success", "Success"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=8,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_at", models.DateTimeField(null=True)),
+                ("duration", models.DurationField(null=True)),
+                ("api_calls", models.PositiveIntegerField(default=0)),
+                ("transactions_created", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("max_age", models.DurationField(null=True)),
+                ("history", models.BooleanField(default=False)),
+                (
+                    "integration",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.integration",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started_at"],
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="AccountSyncResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("success", "Success"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=8,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_at", models.DateTimeField(null=True)),
+                ("duration", models.DurationField(null=True)),
+                ("api_calls", models.PositiveIntegerField(default=0)),
+                ("transactions_created", models.PositiveIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.account",
+                    ),
+                ),
+                (
+                    "sync_run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.syncrun",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started_at"],
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0014_syncrun"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InstitutionCatalog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("country", models.CharField(max_length=2, unique=True)),
+                ("synced_at", models.DateTimeField()),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
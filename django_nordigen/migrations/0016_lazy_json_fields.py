@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:08
+
+from django.db import migrations
+
+import django_nordigen.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0015_institutioncatalog"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="account",
+            name="api_data",
+            field=django_nordigen.models.LazyJSONField(),
+        ),
+        migrations.AlterField(
+            model_name="account",
+            name="api_details",
+            field=django_nordigen.models.LazyJSONField(),
+        ),
+        migrations.AlterField(
+            model_name="balance",
+            name="api_data",
+            field=django_nordigen.models.LazyJSONField(),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="api_data",
+            field=django_nordigen.models.LazyJSONField(),
+        ),
+    ]
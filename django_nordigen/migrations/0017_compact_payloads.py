@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import django_nordigen.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0016_lazy_json_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="api_data_compressed",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="transaction_amount",
+            field=models.DecimalField(decimal_places=2, max_digits=18, null=True),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="transaction_currency",
+            field=models.CharField(blank=True, max_length=3),
+        ),
+        migrations.AlterField(
+            model_name="transaction",
+            name="api_data",
+            field=django_nordigen.models.LazyJSONField(null=True),
+        ),
+        migrations.CreateModel(
+            name="PayloadDictionary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("algorithm", models.CharField(max_length=8)),
+                ("data", models.BinaryField()),
+                (
+                    "institution",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.institution",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="payload_dictionary",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="django_nordigen.payloaddictionary",
+            ),
+        ),
+    ]
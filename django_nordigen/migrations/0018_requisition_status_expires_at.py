@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:14
+
+from django.db import migrations, models
+
+
+def extract_status(apps, schema_editor):
+    Requisition = apps.get_model("django_nordigen", "Requisition")
+    for requisition in Requisition.objects.exclude(api_data=None):
+        requisition.status = requisition.api_data.get("status", "")
+        requisition.save(update_fields=["status"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0017_compact_payloads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="requisition",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="requisition",
+            name="status",
+            field=models.CharField(blank=True, max_length=2),
+        ),
+        migrations.RunPython(extract_status, migrations.RunPython.noop),
+    ]
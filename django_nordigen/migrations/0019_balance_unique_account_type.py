@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:15
+
+from django.db import migrations, models
+
+
+def delete_duplicates(apps, schema_editor):
+    Balance = apps.get_model("django_nordigen", "Balance")
+    latest = (
+        Balance.objects.values("account", "type")
+        .annotate(latest=models.Max("pk"), count=models.Count("pk"))
+        .filter(count__gt=1)
+    )
+    for row in latest:
+        Balance.objects.filter(account=row["account"], type=row["type"]).exclude(
+            pk=row["latest"]
+        ).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0018_requisition_status_expires_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="balance",
+            constraint=models.UniqueConstraint(
+                fields=("account", "type"), name="nordigen_unique_account_balance_type"
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import django_nordigen.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0019_balance_unique_account_type"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTransaction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("nordigen_id", models.CharField(max_length=32)),
+                ("api_data", django_nordigen.models.LazyJSONField(null=True)),
+                ("booking_date", models.DateField(null=True)),
+                (
+                    "transaction_amount",
+                    models.DecimalField(decimal_places=2, max_digits=18, null=True),
+                ),
+                ("transaction_currency", models.CharField(blank=True, max_length=3)),
+                ("api_data_compressed", models.BinaryField(null=True)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.account",
+                    ),
+                ),
+                (
+                    "payload_dictionary",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="django_nordigen.payloaddictionary",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-booking_date", "-pk"],
+                "abstract": False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="archivedtransaction",
+            constraint=models.UniqueConstraint(
+                fields=("account", "nordigen_id"),
+                name="nordigen_unique_archived_account_internal_id",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0020_archivedtransaction"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("month", models.DateField()),
+                ("currency", models.CharField(max_length=3)),
+                (
+                    "inflow",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=18),
+                ),
+                (
+                    "outflow",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=18),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="django_nordigen.account",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-month", "currency"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="monthlyrollup",
+            constraint=models.UniqueConstraint(
+                fields=("account", "month", "currency"),
+                name="nordigen_unique_account_month_currency",
+            ),
+        ),
+    ]
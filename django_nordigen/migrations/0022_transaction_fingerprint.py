@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0021_monthlyrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedtransaction",
+            name="duplicate",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="archivedtransaction",
+            name="fingerprint",
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="duplicate",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="transaction",
+            name="fingerprint",
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0026_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrequest",
+            name="history",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="syncrequest",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[
+                    (0, "Onboarding"),
+                    (1, "Interactive"),
+                    (2, "Scheduled"),
+                    (3, "Backfill"),
+                ],
+                default=1,
+            ),
+        ),
+        migrations.AddField(
+            model_name="syncrun",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[
+                    (0, "Onboarding"),
+                    (1, "Interactive"),
+                    (2, "Scheduled"),
+                    (3, "Backfill"),
+                ],
+                default=2,
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0027_sync_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncrequest",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
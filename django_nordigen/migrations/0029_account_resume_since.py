@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_nordigen", "0028_syncrequest_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="account",
+            name="resume_since",
+            field=models.DateField(null=True),
+        ),
+    ]
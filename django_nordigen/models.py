@@ -1,11 +1,102 @@
-from datetime import timedelta
+import json
+import logging
+from contextvars import ContextVar
+from datetime import date, timedelta
 
 from django.db import models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.expressions import Col
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from django.db.models.functions import TruncMonth
+from django.db.models.query import ModelIterable
+from django.db.models.query_utils import DeferredAttribute
 from django.utils import timezone
 
+from .aggregates import latest_balance, month_start, transaction_totals
+from .compression import (
+    PayloadCompressor,
+    compress,
+    decompress,
+    encode_json,
+    get_algorithm,
+    parse_amount,
+    restore_payload,
+    strip_payload,
+)
+from .fingerprint import transaction_fingerprint
+
+logger = logging.getLogger(__name__)
+
 TOKEN_GRACE_PERIOD = timedelta(hours=1)
 
 
+# Set only while PayloadQuerySet builds a model instance from a row
+lazy_json = ContextVar("lazy_json", default=False)
+
+
+class EncodedJSON(str):
+    def decode(self):
+        return json.loads(self)
+
+
+class LazyJSONAttribute(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, EncodedJSON):
+            value = instance.__dict__[self.field.attname] = value.decode()
+        return value
+
+    def __set__(self, instance, value):
+        # A data descriptor, so reads can't bypass __get__ via the instance dict
+        instance.__dict__[self.field.attname] = value
+
+
+class LazyJSONField(models.JSONField):
+    # Values loaded into model instances stay encoded until the attribute is
+    # first read; any other query decodes them like JSONField
+    descriptor_class = LazyJSONAttribute
+
+    def from_db_value(self, value, expression, connection):
+        if lazy_json.get() and isinstance(expression, Col) and isinstance(value, str):
+            return EncodedJSON(value)
+        return super().from_db_value(value, expression, connection)
+
+
+class LazyModelIterable(ModelIterable):
+    def __iter__(self):
+        rows = super().__iter__()
+        annotations = list(self.queryset.query.annotation_select)
+        while True:
+            token = lazy_json.set(True)
+            try:
+                obj = next(rows)
+            except StopIteration:
+                return
+            finally:
+                lazy_json.reset(token)
+
+            # Annotations are plain attributes, without the decoding descriptor
+            for name in annotations:
+                value = getattr(obj, name)
+                if isinstance(value, EncodedJSON):
+                    setattr(obj, name, value.decode())
+            yield obj
+
+
+class PayloadQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._iterable_class = LazyModelIterable
+
+    def with_payload(self):
+        return self.defer(None)
+
+
+class PayloadManager(models.Manager.from_queryset(PayloadQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.model.payload_fields)
+
+
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -25,10 +116,10 @@ class Integration(BaseModel):
     def __str__(self):
         return str(self.nordigen_id)
 
-    def get_token(self, token_type):
+    def get_token(self, token_type, margin=timedelta(0)):
         qs = self.token_set.filter(
             type=token_type,
-            expires__gt=timezone.now() + TOKEN_GRACE_PERIOD,
+            expires__gt=timezone.now() + TOKEN_GRACE_PERIOD + margin,
         )
         return qs.first()
 
@@ -80,8 +171,23 @@ class Institution(BaseModel):
     def logo(self):
         return self.api_data["logo"]
 
+    @property
+    def countries(self):
+        return self.api_data.get("countries", [])
+
+
+class InstitutionCatalog(BaseModel):
+    country = models.CharField(max_length=2, unique=True)
+    synced_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.country
+
 
 class Requisition(BaseModel):
+    # Statuses after which the requisition will never give access again
+    DEAD_STATUSES = ["EX", "RJ", "SU"]
+
     integration = models.ForeignKey(Integration, on_delete=models.CASCADE)
     nordigen_id = models.UUIDField(unique=True)
     reference_id = models.UUIDField()
@@ -90,6 +196,8 @@ class Requisition(BaseModel):
     institution = models.ForeignKey(Institution, on_delete=models.CASCADE)
     max_historical_days = models.PositiveSmallIntegerField()
     active = models.BooleanField(default=True)
+    status = models.CharField(max_length=2, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return str(self.nordigen_id)
@@ -97,16 +205,38 @@ class Requisition(BaseModel):
     def __repr__(self):
         return f"<{type(self).__name__}: {self} ({self.institution.nordigen_id})>"
 
+    def is_dead(self, now):
+        if self.status in self.DEAD_STATUSES:
+            return True
+        return self.expires_at is not None and self.expires_at <= now
+
+    def deactivate(self):
+        logger.info(
+            "Deactivating requisition %r (status %r, expires %s)",
+            self,
+            self.status,
+            self.expires_at,
+        )
+        self.active = False
+        self.save(update_fields=["active"])
+
 
 class Account(BaseModel):
     integration = models.ForeignKey(Integration, on_delete=models.CASCADE)
     institution = models.ForeignKey(Institution, on_delete=models.CASCADE)
     nordigen_id = models.UUIDField(unique=True)
-    api_data = models.JSONField()
-    api_details = models.JSONField()
+    api_data = LazyJSONField()
+    api_details = LazyJSONField()
     requisitions = models.ManyToManyField(Requisition, blank=True)
     synced_at = models.DateTimeField(null=True)
     alias = models.CharField(max_length=1000, blank=True)
+    # Start of a streamed sync that was saved only in part; the next sync
+    # fetches again from here, whatever the latest stored booking date
+    resume_since = models.DateField(null=True)
+
+    # api_details stays loaded, it's needed for __str__
+    payload_fields = ["api_data"]
+    objects = PayloadManager()
 
     class Meta:
         ordering = ["-synced_at"]
@@ -122,9 +252,87 @@ class Account(BaseModel):
     def __str__(self):
         return self.alias or self.iban or str(self.nordigen_id)
 
+    def siblings(self):
+        # The same bank account linked again through another requisition of
+        # the same integration
+        if not self.iban:
+            return Account.objects.none()
+        return Account.objects.filter(
+            integration=self.integration_id, api_details__account__iban=self.iban
+        ).exclude(pk=self.pk)
+
+    def flag_duplicates(self, fingerprints, since):
+        # The sibling with the lowest pk is canonical; copies of its
+        # transactions on later siblings are flagged, in whichever order they
+        # sync. Must run in a transaction. Returns changed months per sibling.
+        changed = {}
+        for sibling in self.siblings().filter(pk__gt=self.pk).order_by("pk"):
+            # Locked in pk order, after this account, so writers can't deadlock
+            Account.objects.select_for_update().filter(pk=sibling.pk).exists()
+            flagged = 0
+            for queryset in [sibling.transaction_set, sibling.archivedtransaction_set]:
+                pks = [
+                    pk
+                    for pk, fingerprint in queryset.filter(
+                        booking_date__gte=since, duplicate=False
+                    ).values_list("pk", "fingerprint")
+                    if fingerprint in fingerprints
+                ]
+                for start in range(0, len(pks), 1000):
+                    flagged += queryset.filter(pk__in=pks[start:][:1000]).update(
+                        duplicate=True
+                    )
+            if flagged:
+                changed[sibling.pk] = MonthlyRollup.rebuild(sibling)
+        return changed
+
+    def unflag_duplicates(self, fingerprints):
+        # After this account's transactions with these fingerprints were
+        # deleted, copies on later siblings are real unless an earlier sibling
+        # still has them. Must run in a transaction. Returns changed months
+        # per sibling.
+        changed = {}
+        siblings = list(self.siblings().order_by("pk"))
+        for sibling in siblings:
+            if sibling.pk < self.pk:
+                continue
+            Account.objects.select_for_update().filter(pk=sibling.pk).exists()
+            earlier = [self] + [other for other in siblings if other.pk < sibling.pk]
+            kept = set()
+            for model in [Transaction, ArchivedTransaction]:
+                queryset = model.objects.filter(account__in=earlier)
+                values = list(fingerprints)
+                for start in range(0, len(values), 1000):
+                    kept.update(
+                        queryset.filter(
+                            fingerprint__in=values[start:][:1000]
+                        ).values_list("fingerprint", flat=True)
+                    )
+
+            unflagged = 0
+            for queryset in [sibling.transaction_set, sibling.archivedtransaction_set]:
+                pks = [
+                    pk
+                    for pk, fingerprint in queryset.filter(duplicate=True).values_list(
+                        "pk", "fingerprint"
+                    )
+                    if fingerprint in fingerprints and fingerprint not in kept
+                ]
+                for start in range(0, len(pks), 1000):
+                    unflagged += queryset.filter(pk__in=pks[start:][:1000]).update(
+                        duplicate=False
+                    )
+            if unflagged:
+                changed[sibling.pk] = MonthlyRollup.rebuild(sibling)
+        return changed
+
     @property
     def balance(self):
-        balances = {balance.type: balance.amount for balance in self.balance_set.all()}
+        return latest_balance(self)
+
+    def compute_balance(self):
+        amount = KeyTextTransform("amount", KeyTransform("balanceAmount", "api_data"))
+        balances = dict(self.balance_set.values_list("type", amount))
         if balances:
             return balances.get("expected") or list(balances.values())[0]
 
@@ -132,9 +340,20 @@ class Account(BaseModel):
 class Balance(BaseModel):
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
     type = models.CharField(max_length=100)
-    api_data = models.JSONField()
+    api_data = LazyJSONField()
     synced_at = models.DateTimeField(null=True)
 
+    payload_fields = ["api_data"]
+    objects = PayloadManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "type"],
+                name="nordigen_unique_account_balance_type",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.amount} {self.currency}"
 
@@ -147,34 +366,387 @@ class Balance(BaseModel):
         return self.api_data["balanceAmount"]["currency"]
 
 
-class Transaction(BaseModel):
+class PayloadDictionary(BaseModel):
+    institution = models.ForeignKey(Institution, on_delete=models.CASCADE)
+    algorithm = models.CharField(max_length=8)
+    data = models.BinaryField()
+
+    cache = {}
+
+    def __str__(self):
+        return f"{self.algorithm} dictionary for {self.institution_id}"
+
+    @classmethod
+    def get_data(cls, pk):
+        if pk not in cls.cache:
+            cls.cache[pk] = bytes(cls.objects.get(pk=pk).data)
+        return cls.cache[pk]
+
+    @classmethod
+    def get_compressor(cls, institution_id):
+        algorithm = get_algorithm()
+        dictionary = (
+            cls.objects.filter(institution_id=institution_id, algorithm=algorithm)
+            .order_by("-pk")
+            .first()
+        )
+        return PayloadCompressor(algorithm, dictionary)
+
+
+class BaseTransaction(BaseModel):
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
     nordigen_id = models.CharField(max_length=32)
-    api_data = models.JSONField()
+    api_data = LazyJSONField(null=True)
     booking_date = models.DateField(null=True)
+    transaction_amount = models.DecimalField(max_digits=18, decimal_places=2, null=True)
+    transaction_currency = models.CharField(max_length=3, blank=True)
+    api_data_compressed = models.BinaryField(null=True)
+    payload_dictionary = models.ForeignKey(
+        PayloadDictionary, null=True, on_delete=models.PROTECT
+    )
+    fingerprint = models.CharField(max_length=32, blank=True, db_index=True)
+    duplicate = models.BooleanField(default=False)
+
+    payload_fields = ["api_data", "api_data_compressed"]
+    objects = PayloadManager()
 
     class Meta:
-        constraints = [
-            models.UniqueConstraint(
-                fields=["account", "nordigen_id"],
-                name="nordigen_unique_account_internal_id",
-            ),
-        ]
+        abstract = True
         ordering = ["-booking_date", "-pk"]
 
     def __str__(self):
         return f"{self.amount} {self.currency}"
 
+    @classmethod
+    def from_api(cls, account, nordigen_id, api_data, compressor=None, fingerprints=()):
+        bookingDate = api_data.get("bookingDate")
+        fingerprint = transaction_fingerprint(api_data)
+        tr = cls(
+            account=account,
+            nordigen_id=nordigen_id,
+            booking_date=bookingDate and date.fromisoformat(bookingDate),
+            fingerprint=fingerprint,
+            duplicate=fingerprint in fingerprints,
+        )
+        tr.set_payload(api_data, compressor)
+        return tr
+
+    @property
+    def data(self):
+        # Either payload field may be needed, so load both in one query
+        deferred = self.get_deferred_fields()
+        if deferred.intersection(self.payload_fields):
+            self.refresh_from_db(fields=self.payload_fields)
+
+        if self.api_data is None and self.api_data_compressed is not None:
+            dictionary = self.payload_dictionary_id and PayloadDictionary.get_data(
+                self.payload_dictionary_id
+            )
+            remainder = json.loads(decompress(self.api_data_compressed, dictionary))
+            return restore_payload(remainder, *self.payload_columns)
+        return self.api_data
+
+    @property
+    def payload_columns(self):
+        return [
+            self.nordigen_id,
+            self.booking_date,
+            self.transaction_amount,
+            self.transaction_currency,
+        ]
+
+    def set_payload(self, api_data, compressor=None):
+        self.transaction_amount, self.transaction_currency = parse_amount(api_data)
+        if compressor is None:
+            self.api_data = api_data
+            self.api_data_compressed = None
+            self.payload_dictionary = None
+
+        else:
+            remainder = strip_payload(api_data, *self.payload_columns)
+            self.api_data = None
+            self.api_data_compressed = compressor.compress(remainder)
+            self.payload_dictionary = compressor.dictionary
+
     @property
     def amount(self):
-        return self.api_data["transactionAmount"]["amount"]
+        return self.data["transactionAmount"]["amount"]
 
     @property
     def currency(self):
-        return self.api_data["transactionAmount"]["currency"]
+        return self.data["transactionAmount"]["currency"]
 
     @property
     def description(self):
-        return self.api_data.get("remittanceInformationUnstructured") or " ".join(
-            self.api_data.get("remittanceInformationUnstructuredArray", [])
+        data = self.data
+        return data.get("remittanceInformationUnstructured") or " ".join(
+            data.get("remittanceInformationUnstructuredArray", [])
         )
+
+
+class Transaction(BaseTransaction):
+    class Meta(BaseTransaction.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "nordigen_id"],
+                name="nordigen_unique_account_internal_id",
+            ),
+        ]
+
+
+class ArchivedTransaction(BaseTransaction):
+    class Meta(BaseTransaction.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "nordigen_id"],
+                name="nordigen_unique_archived_account_internal_id",
+            ),
+        ]
+
+
+class TransactionResponse(BaseModel):
+    # Raw get_transactions responses, kept so transactions can be rebuilt
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    date_from = models.DateField()
+    date_to = models.DateField()
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ["pk"]
+
+    def __str__(self):
+        return f"{self.account} {self.date_from} - {self.date_to}"
+
+    @classmethod
+    def archive(cls, account, date_from, date_to, response):
+        return cls.objects.create(
+            account=account,
+            date_from=date_from,
+            date_to=date_to,
+            data=compress(encode_json(response), get_algorithm()),
+        )
+
+    @property
+    def response(self):
+        return json.loads(decompress(self.data))
+
+
+class MonthlyRollup(BaseModel):
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    month = models.DateField()
+    currency = models.CharField(max_length=3)
+    inflow = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    outflow = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-month", "currency"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "month", "currency"],
+                name="nordigen_unique_account_month_currency",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.month:%Y-%m} {self.currency}"
+
+    @classmethod
+    def add(cls, account, transactions):
+        # Callers hold the account row lock, so there is no insert race
+        for (month, currency), (inflow, outflow, count) in transaction_totals(
+            transactions
+        ).items():
+            updated = cls.objects.filter(
+                account=account, month=month, currency=currency
+            ).update(
+                inflow=F("inflow") + inflow,
+                outflow=F("outflow") + outflow,
+                count=F("count") + count,
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                cls.objects.create(
+                    account=account,
+                    month=month,
+                    currency=currency,
+                    inflow=inflow,
+                    outflow=outflow,
+                    count=count,
+                )
+
+    @classmethod
+    def rebuild(cls, account):
+        totals = {}
+        for queryset in [account.transaction_set, account.archivedtransaction_set]:
+            queryset = queryset.filter(booking_date__isnull=False, duplicate=False)
+            for row in (
+                queryset.exclude(transaction_amount=None)
+                .annotate(month=TruncMonth("booking_date"))
+                .values("month", "transaction_currency")
+                .annotate(
+                    inflow=Sum(
+                        "transaction_amount", filter=Q(transaction_amount__gt=0)
+                    ),
+                    outflow=Sum(
+                        "transaction_amount", filter=Q(transaction_amount__lt=0)
+                    ),
+                    count=Count("pk"),
+                )
+                .order_by()
+            ):
+                key = month_start(row["month"]), row["transaction_currency"]
+                old = totals.get(key, [0, 0, 0])
+                totals[key] = [
+                    old[0] + (row["inflow"] or 0),
+                    old[1] - (row["outflow"] or 0),
+                    old[2] + row["count"],
+                ]
+
+            slow = queryset.filter(transaction_amount=None).with_payload()
+            for key, new in transaction_totals(slow).items():
+                old = totals.get(key, [0, 0, 0])
+                totals[key] = [a + b for a, b in zip(old, new)]
+
+        months = set(account.monthlyrollup_set.values_list("month", flat=True))
+        account.monthlyrollup_set.all().delete()
+        cls.objects.bulk_create(
+            cls(
+                account=account,
+                month=month,
+                currency=currency,
+                inflow=inflow,
+                outflow=outflow,
+                count=count,
+            )
+            for (month, currency), (inflow, outflow, count) in totals.items()
+        )
+        return months | {month for month, _ in totals}
+
+
+class SyncPriority(models.IntegerChoices):
+    ONBOARDING = 0, "Onboarding"
+    INTERACTIVE = 1, "Interactive"
+    SCHEDULED = 2, "Scheduled"
+    BACKFILL = 3, "Backfill"
+
+
+INTERACTIVE_PRIORITIES = [SyncPriority.ONBOARDING, SyncPriority.INTERACTIVE]
+
+
+class SyncRequest(BaseModel):
+    # created_at is the first request, updated_at the latest one
+    account = models.OneToOneField(Account, on_delete=models.CASCADE)
+    not_before = models.DateTimeField()
+    priority = models.PositiveSmallIntegerField(
+        choices=SyncPriority.choices, default=SyncPriority.INTERACTIVE
+    )
+    history = models.BooleanField(default=False)
+    # Failed syncs so far; each one pushes not_before further back
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sync {self.account}"
+
+
+class BackfillProgress(BaseModel):
+    name = models.CharField(max_length=100, unique=True)
+    # Every row below last_pk has been processed
+    last_pk = models.BigIntegerField(default=0)
+    max_pk = models.BigIntegerField(null=True)
+    changed = models.PositiveBigIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Job(BaseModel):
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        SUCCESS = "success", "Success"
+        FAILED = "failed", "Failed"
+
+    name = models.CharField(max_length=200)
+    status = models.CharField(
+        max_length=8, choices=Status.choices, default=Status.RUNNING
+    )
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def percent(self):
+        return 100 * self.done // self.total if self.total else 100
+
+    def finish(self):
+        self.refresh_from_db()
+        self.finished_at = timezone.now()
+        self.status = self.Status.FAILED if self.failed else self.Status.SUCCESS
+        self.save(update_fields=["finished_at", "status", "updated_at"])
+
+
+class BaseSyncRecord(BaseModel):
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        SUCCESS = "success", "Success"
+        FAILED = "failed", "Failed"
+
+    status = models.CharField(
+        max_length=8, choices=Status.choices, default=Status.RUNNING
+    )
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True)
+    duration = models.DurationField(null=True)
+    api_calls = models.PositiveIntegerField(default=0)
+    transactions_created = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        abstract = True
+        ordering = ["-started_at"]
+
+    def finish(self, api_calls, error=None):
+        self.finished_at = timezone.now()
+        self.duration = self.finished_at - self.started_at
+        self.api_calls = api_calls
+        if error is None:
+            self.status = self.Status.SUCCESS
+        else:
+            self.status = self.Status.FAILED
+            self.error = repr(error)
+        self.save()
+
+
+class SyncRun(BaseSyncRecord):
+    integration = models.ForeignKey(Integration, on_delete=models.CASCADE)
+    max_age = models.DurationField(null=True)
+    history = models.BooleanField(default=False)
+    priority = models.PositiveSmallIntegerField(
+        choices=SyncPriority.choices, default=SyncPriority.SCHEDULED
+    )
+
+    class Meta(BaseSyncRecord.Meta):
+        pass
+
+    def __str__(self):
+        return f"Sync at {self.started_at:%Y-%m-%d %H:%M:%S}"
+
+
+class AccountSyncResult(BaseSyncRecord):
+    sync_run = models.ForeignKey(SyncRun, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+
+    class Meta(BaseSyncRecord.Meta):
+        pass
+
+    def __str__(self):
+        return f"{self.account} in {self.sync_run}"
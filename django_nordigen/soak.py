@@ -0,0 +1,198 @@
+import gc
+import logging
+import random
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import override_settings
+from django.utils import timezone
+
+from .aggregates import transaction_count
+from .api import ALL_REQUISITIONS, get_api
+from .benchmark import setup_data
+from .fake_api import FakeNordigenServer
+from .models import Account, MonthlyRollup, Token, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.syncs = 0
+        self.errors = Counter()
+        # Wrappers of finished threads are collected unless something leaks them
+        self.connections = weakref.WeakSet()
+
+    def success(self):
+        with self.lock:
+            self.syncs += 1
+
+    def failure(self, error):
+        with self.lock:
+            self.errors[type(error).__name__] += 1
+
+    def connection_created(self, sender, connection, **kwargs):
+        with self.lock:
+            self.connections.add(connection)
+
+    def open_connections(self, exclude=None):
+        with self.lock:
+            return sum(
+                1
+                for conn in self.connections
+                if conn.connection is not None and conn is not exclude
+            )
+
+
+def sync_worker(stats, stop, account_ids, seed):
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        try:
+            account = Account.objects.get(pk=rnd.choice(account_ids))
+            get_api().sync_account(account, history=False)
+            stats.success()
+
+        except Exception as error:
+            logger.debug("Soak sync failed", exc_info=True)
+            stats.failure(error)
+
+        finally:
+            close_old_connections()
+    connection.close()
+
+
+def token_expirer(stop, interval):
+    # Forces concurrent workers to renew the access token at the same time
+    while not stop.wait(interval):
+        try:
+            Token.objects.filter(type=Token.TokenType.ACCESS).update(
+                expires=timezone.now() - timedelta(minutes=1)
+            )
+
+        except Exception:
+            logger.exception("Could not expire tokens")
+    connection.close()
+
+
+def rollup_snapshot():
+    return set(
+        MonthlyRollup.objects.values_list(
+            "account", "month", "currency", "inflow", "outflow", "count"
+        )
+    )
+
+
+def check_consistency():
+    problems = []
+    duplicated = (
+        Transaction.objects.values("account", "nordigen_id")
+        .annotate(n=Count("pk"))
+        .filter(n__gt=1)
+        .count()
+    )
+    if duplicated:
+        problems.append(f"{duplicated} transactions stored more than once")
+
+    for account in Account.objects.all():
+        cached = transaction_count(account)
+        actual = account.transaction_set.count()
+        if cached != actual:
+            problems.append(f"account {account.pk}: cached count {cached} != {actual}")
+
+    rollups = rollup_snapshot()
+    for account in Account.objects.all():
+        MonthlyRollup.rebuild(account)
+    if rollups != rollup_snapshot():
+        problems.append("monthly rollups differ from a rebuild")
+
+    return problems
+
+
+def format_report(elapsed, stats, fake, memory, baseline):
+    with stats.lock:
+        syncs = stats.syncs
+        errors = sum(stats.errors.values())
+    return (
+        f"{elapsed:7.1f}s  syncs {syncs} ({syncs / elapsed:.1f}/s)"
+        f"  errors {errors} ({errors / max(syncs + errors, 1):.1%})"
+        f"  api {fake.request_count} (injected {fake.error_count})"
+        f"  connections {stats.open_connections()}"
+        f"  memory {memory / 2**20:.1f} MiB ({(memory - baseline) / 2**20:+.1f})"
+    )
+
+
+def run_soak(
+    fake, duration, threads=8, report_interval=10, token_expiry=None, report=None
+):
+    # report, if given, is called with each line of progress output
+    report = report or (lambda line: None)
+    stats = Stats()
+    stop = threading.Event()
+    with FakeNordigenServer(fake) as server:
+        integration = setup_data(fake)
+        with override_settings(
+            NORDIGEN_BASE_URL=server.base_url,
+            NORDIGEN_ID=integration.nordigen_id,
+            NORDIGEN_KEY="soak",
+            # The debug query log would look like memory growth
+            DEBUG=False,
+        ):
+            # Faults are only injected once the initial data is in place
+            rates = fake.error_rate, fake.throttle_rate
+            fake.error_rate = fake.throttle_rate = 0
+            report("Initial sync...")
+            get_api().sync(ALL_REQUISITIONS, timedelta(0), history=True)
+            fake.error_rate, fake.throttle_rate = rates
+            account_ids = list(Account.objects.values_list("pk", flat=True))
+
+            connection_created.connect(stats.connection_created)
+            tracemalloc.start()
+            workers = [
+                threading.Thread(target=sync_worker, args=(stats, stop, account_ids, n))
+                for n in range(threads)
+            ]
+            if token_expiry:
+                workers.append(
+                    threading.Thread(target=token_expirer, args=(stop, token_expiry))
+                )
+            for worker in workers:
+                worker.start()
+
+            start = time.perf_counter()
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                while not stop.wait(report_interval):
+                    elapsed = time.perf_counter() - start
+                    memory = tracemalloc.get_traced_memory()[0]
+                    report(format_report(elapsed, stats, fake, memory, baseline))
+                    if elapsed >= duration:
+                        stop.set()
+
+            finally:
+                stop.set()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                connection_created.disconnect(stats.connection_created)
+
+            report(format_report(elapsed, stats, fake, memory, baseline))
+            for name, count in stats.errors.most_common():
+                report(f"  {name}: {count}")
+
+    # Worker threads are gone; only this thread's connection may remain
+    gc.collect()
+    leaked = stats.open_connections(exclude=connections["default"])
+    problems = check_consistency()
+    if leaked:
+        problems.append(f"{leaked} database connections left open")
+    return stats, problems
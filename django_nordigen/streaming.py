@@ -0,0 +1,100 @@
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = ".eE+-0123456789"
+TRANSACTION_LISTS = ["booked", "pending"]
+
+decoder = json.JSONDecoder()
+
+
+class StreamParser:
+    # Just enough of a JSON parser to walk a document piece by piece while
+    # only holding the current value and one chunk in memory
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder("utf8")()
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                pos = self.pos
+                self.buffer = self.buffer[pos:] + self.text.decode(chunk)
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at {self.buffer[self.pos:][:20]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number near the end of the buffer may continue in the next
+            # chunk; raw_decode stops early on e.g. "0." or "1e"
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and (end >= len(self.buffer) - 1 or self.buffer[end] in NUMBER_CHARS)
+                and self.fill()
+            ):
+                continue
+            self.pos = end
+            return value
+
+    def items(self, open_char, close_char):
+        # Yields once per member of an object or array, positioned at it
+        self.expect(open_char)
+        if self.peek() == close_char:
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == close_char:
+                return
+            if char != ",":
+                raise ValueError(f"Unexpected {char!r} in JSON document")
+
+    def keys(self):
+        for _ in self.items("{", "}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+
+def iter_transactions(chunks):
+    # Yields ("booked" or "pending", api_data) from a transactions response
+    parser = StreamParser(chunks)
+    for key in parser.keys():
+        if key != "transactions":
+            parser.value()
+            continue
+
+        for status in parser.keys():
+            if status not in TRANSACTION_LISTS:
+                parser.value()
+                continue
+
+            for _ in parser.items("[", "]"):
+                yield status, parser.value()
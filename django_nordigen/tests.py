@@ -0,0 +1,329 @@
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from unittest import TestCase, mock
+from uuid import uuid4
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.test import RequestFactory
+from django.test import TestCase as DjangoTestCase
+from django.test import override_settings
+from django.utils import timezone
+
+from .admin import TransactionAdmin
+from .aggregates import monthly_totals
+from .api import (
+    ALL_REQUISITIONS,
+    SYNC_REQUEST_LEASE,
+    Api,
+    process_sync_requests,
+    request_sync,
+)
+from .fake_api import FakeNordigen
+from .models import (
+    Account,
+    ArchivedTransaction,
+    Institution,
+    Integration,
+    MonthlyRollup,
+    Requisition,
+    SyncRequest,
+    Transaction,
+)
+from .streaming import iter_transactions
+from .views import sync
+
+
+class IterTransactionsTest(TestCase):
+    def parse_split(self, document):
+        # Every way of splitting the document into two chunks
+        data = document.encode("utf8")
+        for split in range(len(data) + 1):
+            with self.subTest(split=split):
+                yield list(iter_transactions([data[:split], data[split:]]))
+
+    def test_numbers_across_chunk_boundaries(self):
+        # Compact and spaced, with exponents that json.dumps would not write
+        texts = [
+            '{"x":12.25,"y":[-0.5,1e5,2.5E-3,0,-7],'
+            '"transactions":{"booked":[0.5,{"a":1e5}],"pending":[-12.0]}}',
+            '{"x": 12.25, "y": [-0.5, 1e5, 2.5E-3, 0, -7], '
+            '"transactions": {"booked": [0.5, {"a": 1e5}], "pending": [-12.0]}}',
+        ]
+        expected = [
+            ("booked", 0.5),
+            ("booked", {"a": 1e5}),
+            ("pending", -12.0),
+        ]
+        for text in texts:
+            for result in self.parse_split(text):
+                self.assertEqual(result, expected)
+
+    def test_one_byte_chunks(self):
+        text = '{"x": 12.25, "transactions": {"booked": [1e5, "é", true]}}'
+        chunks = [bytes([byte]) for byte in text.encode("utf8")]
+        self.assertEqual(
+            list(iter_transactions(chunks)),
+            [("booked", 1e5), ("booked", "é"), ("booked", True)],
+        )
+
+
+fake = FakeNordigen()
+
+
+def create_account(integration=None, iban=None):
+    integration = integration or Integration.objects.create(nordigen_id=uuid4())
+    institution, _ = Institution.objects.get_or_create(
+        nordigen_id=fake.institution_id(0),
+        defaults=dict(api_data=fake.institution(fake.institution_id(0))),
+    )
+    nordigen_id = str(uuid4())
+    api_details = fake.details(nordigen_id)
+    if iban:
+        api_details["account"]["iban"] = iban
+    return Account.objects.create(
+        integration=integration,
+        institution=institution,
+        nordigen_id=nordigen_id,
+        api_data=fake.account(next(iter(fake.accounts))),
+        api_details=api_details,
+    )
+
+
+def archive(tr):
+    return ArchivedTransaction.objects.create(
+        **{
+            field.name: getattr(tr, field.name)
+            for field in Transaction._meta.concrete_fields
+            if field.name != "id"
+        }
+    )
+
+
+class StreamedSyncTest(DjangoTestCase):
+    def setUp(self):
+        self.account = create_account()
+        # Newest first, two a day
+        today = timezone.now().date()
+        self.rows = [
+            fake.transaction(
+                str(self.account.nordigen_id), n, today - timedelta(days=1 + n // 2)
+            )
+            for n in range(40)
+        ]
+        self.client = mock.MagicMock(response_cache=None)
+        self.api = Api(self.account.integration, self.client)
+
+    def stream(self, fail_after=None):
+        def stream_transactions(account_id, date_from, date_to):
+            for n, api_data in enumerate(self.rows):
+                if n == fail_after:
+                    raise ConnectionError("Stream interrupted")
+                booking_date = api_data["bookingDate"]
+                if date_from.isoformat() <= booking_date <= date_to.isoformat():
+                    yield "booked", api_data
+
+        self.client.stream_transactions.side_effect = stream_transactions
+
+    @override_settings(NORDIGEN_STREAM_TRANSACTIONS=True)
+    @mock.patch("django_nordigen.api.STREAM_BATCH_SIZE", 5)
+    def test_interrupted_stream_is_fetched_again(self):
+        self.stream(fail_after=15)
+        with self.assertRaises(ConnectionError):
+            self.api.sync_account(self.account, history=False)
+        self.assertEqual(Transaction.objects.count(), 15)
+
+        self.stream()
+        self.api.sync_account(self.account, history=False)
+        self.assertEqual(Transaction.objects.count(), 40)
+        self.account.refresh_from_db()
+        self.assertIsNone(self.account.resume_since)
+
+
+@override_settings(NORDIGEN_WEBHOOK_SECRET="secret")
+class SyncViewTest(DjangoTestCase):
+    def post(self, signature, timestamp=None):
+        body = json.dumps({"accounts": []}).encode()
+        timestamp = str(int(time.time())) if timestamp is None else timestamp
+        if callable(signature):
+            signature = signature(timestamp, body)
+        request = RequestFactory().post(
+            "/sync",
+            body,
+            content_type="application/json",
+            HTTP_X_NORDIGEN_TIMESTAMP=timestamp,
+            HTTP_X_NORDIGEN_SIGNATURE=signature,
+        )
+        return sync(request)
+
+    def sign(self, timestamp, body):
+        return hmac.new(
+            b"secret", timestamp.encode() + b"." + body, hashlib.sha256
+        ).hexdigest()
+
+    def test_valid_signature(self):
+        self.assertEqual(self.post(self.sign).status_code, 202)
+
+    def test_invalid_signatures(self):
+        for signature in ["", "0" * 64, "é" * 64, "\u2603"]:
+            with self.subTest(signature=signature):
+                self.assertEqual(self.post(signature).status_code, 403)
+
+    def test_stale_timestamp(self):
+        response = self.post(self.sign, timestamp=str(int(time.time()) - 3600))
+        self.assertEqual(response.status_code, 403)
+
+
+class TransactionAdminTest(DjangoTestCase):
+    def setUp(self):
+        self.first = create_account(iban="XX00SAME")
+        self.second = create_account(self.first.integration, iban="XX00SAME")
+        day = timezone.now().date()
+        for account in [self.first, self.second]:
+            rows = [
+                Transaction.from_api(
+                    account,
+                    f"{account.pk}-{n}",
+                    fake.transaction("same", n, day),
+                    fingerprints=set(
+                        Transaction.objects.exclude(account=account).values_list(
+                            "fingerprint", flat=True
+                        )
+                    ),
+                )
+                for n in range(3)
+            ]
+            Transaction.objects.bulk_create(rows)
+            MonthlyRollup.rebuild(account)
+
+    def test_delete_unflags_later_siblings_and_rebuilds_rollups(self):
+        self.assertEqual(self.second.transaction_set.filter(duplicate=True).count(), 3)
+        self.assertEqual(self.second.monthlyrollup_set.count(), 0)
+
+        deleted = self.first.transaction_set.order_by("pk")[:2]
+        TransactionAdmin(Transaction, admin.site).delete_queryset(
+            None, Transaction.objects.filter(pk__in=[tr.pk for tr in deleted])
+        )
+
+        self.assertEqual(self.second.transaction_set.filter(duplicate=True).count(), 1)
+        self.assertEqual(self.first.monthlyrollup_set.get().count, 1)
+        self.assertEqual(self.second.monthlyrollup_set.get().count, 2)
+
+
+class DuplicateTest(DjangoTestCase):
+    def fetch(self, account, api_data):
+        client = mock.MagicMock(response_cache=None)
+        client.account_api.return_value.get_transactions.return_value = {
+            "transactions": {"booked": [api_data], "pending": []}
+        }
+        since = timezone.now().date() - timedelta(days=30)
+        new, _ = Api(account.integration, client).fetch_transactions(account, since)
+        return new
+
+    def test_archived_sibling_transactions_are_duplicates(self):
+        first = create_account(iban="XX00SAME")
+        second = create_account(first.integration, iban="XX00SAME")
+        api_data = fake.transaction("same", 0, timezone.now().date())
+        archive(Transaction.from_api(first, "first-0", api_data))
+
+        [tr] = self.fetch(second, api_data)
+        self.assertTrue(tr.duplicate)
+
+    def test_siblings_stay_within_an_integration(self):
+        first = create_account(iban="XX00SAME")
+        second = create_account(iban="XX00SAME")
+        self.assertFalse(second.siblings().exists())
+
+        api_data = fake.transaction("same", 0, timezone.now().date())
+        Transaction.from_api(first, "first-0", api_data).save()
+        [tr] = self.fetch(second, api_data)
+        self.assertFalse(tr.duplicate)
+
+
+class MonthlyTotalsTest(DjangoTestCase):
+    def test_totals_per_currency(self):
+        account = create_account()
+        month = timezone.now().date().replace(day=1)
+        for currency, inflow in [("EUR", 10), ("RON", 50)]:
+            account.monthlyrollup_set.create(
+                month=month, currency=currency, inflow=inflow, outflow=1, count=2
+            )
+
+        totals = monthly_totals(account, month)
+        self.assertEqual(set(totals), {"EUR", "RON"})
+        self.assertEqual(totals["RON"]["inflow"], 50)
+        self.assertEqual(totals["EUR"]["count"], 2)
+
+
+class PlanTest(DjangoTestCase):
+    def test_requisition_not_fetched_is_unknown(self):
+        account = create_account()
+        Requisition.objects.create(
+            integration=account.integration,
+            nordigen_id=uuid4(),
+            reference_id=uuid4(),
+            completed=True,
+            institution=account.institution,
+            max_historical_days=90,
+        )
+
+        [row] = Api(account.integration, None).plan(
+            ALL_REQUISITIONS, timedelta(0), history=True
+        )
+        self.assertTrue(row["unknown"])
+        self.assertEqual(row["requests"], 2)
+
+
+class ProcessSyncRequestsTest(DjangoTestCase):
+    def setUp(self):
+        self.account = create_account()
+        request_sync([self.account], not_before=timezone.now())
+        self.api = mock.Mock()
+
+    def process(self):
+        with mock.patch("django_nordigen.api.get_api", return_value=self.api):
+            return process_sync_requests()
+
+    def test_done_request_is_removed(self):
+        self.assertEqual(self.process(), 1)
+        self.assertFalse(SyncRequest.objects.exists())
+
+    def test_request_made_during_sync_stays_queued(self):
+        self.api.sync_accounts.side_effect = lambda *args: request_sync([self.account])
+        self.process()
+        self.assertTrue(SyncRequest.objects.exists())
+
+    def test_failed_request_is_retried_later(self):
+        self.api.sync_accounts.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError), self.assertLogs("django_nordigen"):
+            self.process()
+        request = SyncRequest.objects.get()
+        self.assertEqual(request.attempts, 1)
+        self.assertGreater(request.not_before, timezone.now())
+
+    def test_crashed_worker_leaves_request_leased(self):
+        self.api.sync_accounts.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            self.process()
+        request = SyncRequest.objects.get()
+        self.assertGreater(request.not_before, timezone.now() + SYNC_REQUEST_LEASE / 2)
+        self.assertEqual(self.process(), 0)
+
+
+class CompactPayloadsTest(DjangoTestCase):
+    def test_archived_transactions_are_compacted(self):
+        account = create_account()
+        tr = Transaction.from_api(
+            account, "0", fake.transaction("same", 0, timezone.now().date())
+        )
+        archived = archive(tr)
+        self.assertIsNone(archived.api_data_compressed)
+
+        with mock.patch("builtins.print"):
+            call_command("nordigen_compact_payloads")
+        archived = ArchivedTransaction.objects.with_payload().get()
+        self.assertIsNotNone(archived.api_data_compressed)
+        self.assertEqual(archived.data, tr.data)
@@ -6,4 +6,5 @@ app_name = "nordigen"
 
 urlpatterns = [
     path("redirect", views.redirect, name="redirect"),
+    path("sync", views.sync, name="sync"),
 ]
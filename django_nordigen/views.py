@@ -1,7 +1,22 @@
-from django.http import HttpResponse
+import hashlib
+import hmac
+import json
+import time
+from uuid import UUID
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .api import get_api, request_sync
+from .models import Account, Requisition, SyncPriority
 
-from .api import get_api
+SIGNATURE_HEADER = "HTTP_X_NORDIGEN_SIGNATURE"
+TIMESTAMP_HEADER = "HTTP_X_NORDIGEN_TIMESTAMP"
+DEFAULT_WEBHOOK_TOLERANCE = 300
 
 
 def redirect(request):
@@ -12,9 +27,61 @@ def redirect(request):
             content_type="text/plain",
         )
     reference_id = request.GET.get("ref")
-    api = get_api()
-    requisition = get_object_or_404(
-        api.integration.requisition_set, reference_id=reference_id
-    )
-    api.accept_requisition(requisition)
+    requisition = get_object_or_404(Requisition, reference_id=reference_id)
+    get_api(requisition.integration).accept_requisition(requisition)
+    request_sync(requisition.account_set.all(), SyncPriority.ONBOARDING, history=True)
     return HttpResponse("Nordigen requisition successful.")
+
+
+def valid_signature(request):
+    secret = getattr(settings, "NORDIGEN_WEBHOOK_SECRET", None)
+    if not secret:
+        return False
+
+    # The timestamp is signed with the body, so old requests can't be replayed
+    timestamp = request.META.get(TIMESTAMP_HEADER, "")
+    tolerance = getattr(
+        settings, "NORDIGEN_WEBHOOK_TOLERANCE", DEFAULT_WEBHOOK_TOLERANCE
+    )
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except ValueError:
+        return False
+
+    # Headers arrive decoded as latin-1; compare bytes, since compare_digest
+    # rejects non-ASCII strings
+    try:
+        signature = request.META.get(SIGNATURE_HEADER, "").encode("latin-1")
+    except UnicodeEncodeError:
+        return False
+
+    expected = hmac.new(
+        secret.encode("utf8"), timestamp.encode() + b"." + request.body, hashlib.sha256
+    )
+    return hmac.compare_digest(expected.hexdigest().encode(), signature)
+
+
+@csrf_exempt
+@require_POST
+def sync(request):
+    if not valid_signature(request):
+        return HttpResponseForbidden("Invalid signature")
+
+    try:
+        payload = json.loads(request.body)
+        account_ids = [UUID(value) for value in payload.get("accounts", [])]
+        requisition_ids = [UUID(value) for value in payload.get("requisitions", [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "Invalid payload"}, status=400)
+
+    accounts = list(
+        Account.objects.filter(requisitions__active=True)
+        .filter(
+            Q(nordigen_id__in=account_ids)
+            | Q(requisitions__nordigen_id__in=requisition_ids)
+        )
+        .distinct()
+    )
+    request_sync(accounts)
+    return JsonResponse({"queued": len(accounts)}, status=202)
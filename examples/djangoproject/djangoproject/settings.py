@@ -71,3 +71,4 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 NORDIGEN_ID = os.environ["NORDIGEN_ID"]
 NORDIGEN_KEY = os.environ["NORDIGEN_KEY"]
 NORDIGEN_SITE_URL = os.environ["NORDIGEN_SITE_URL"]
+NORDIGEN_BASE_URL = os.environ.get("NORDIGEN_BASE_URL")